@@ -1,13 +1,42 @@
 """create_job: Feed SQS queue."""
 
+import importlib.util
 import json
+import os
+import random
+import statistics
+import tempfile
+import time
+import uuid
+from collections import Counter
 from concurrent import futures
-from functools import partial
+from functools import lru_cache, partial
 
 import click
+import pydantic
 from boto3.session import Session as boto3_session
+from botocore.exceptions import ClientError
+from cogeo_mosaic.backends import MosaicBackend
 from rio_tiler.utils import _chunks
 
+from tilebot.messages import decode, parse_message
+from tilebot.metrics import STATUSES, SQLiteSink, read_cloudwatch
+from tilebot.process import _parse_dataset, output_keys, process
+
+STACK_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "stack")
+
+# us-west-2 on-demand prices (USD)
+PRICES = {
+    "lambda_gb_second": 0.0000166667,
+    "lambda_request": 0.20 / 1e6,
+    "fargate_vcpu_hour": 0.04048,
+    "fargate_gb_hour": 0.004445,
+    "sns_publish": 0.50 / 1e6,
+    "sqs_request": 0.40 / 1e6,
+    "s3_put": 0.005 / 1000,
+    "s3_get": 0.0004 / 1000,
+}
+
 
 def aws_send_message(message, topic, client=None):
     """Send SNS message."""
@@ -26,7 +55,211 @@ def sns_worker(messages, topic, subject=None):
     return True
 
 
-@click.command()
+def _output_exists(client, bucket, key):
+    try:
+        client.head_object(Bucket=bucket, Key=key)
+    except ClientError:
+        return False
+    return True
+
+
+def classify_message(body, s3_client=None, bucket=None):
+    """Classify a dead letter message.
+
+    Returns one of `invalid-json`, `invalid-message`, `exists` or `retry`,
+    and the decoded messages (one per tile). With `s3_client` and `bucket`,
+    tiles whose outputs all exist are dropped, and the message is `exists`
+    when no tile is left.
+
+    """
+    try:
+        messages = decode(body)
+    except (ValueError, TypeError):
+        return "invalid-json", []
+
+    try:
+        parsed = [parse_message(m) for m in messages]
+    except (ValueError, TypeError):
+        return "invalid-message", messages
+
+    if s3_client and bucket:
+        messages = [
+            m
+            for m, p in zip(messages, parsed)
+            if not all(_output_exists(s3_client, bucket, k) for k in output_keys(p))
+        ]
+        if not messages:
+            return "exists", []
+
+    return "retry", messages
+
+
+def _merge_messages(messages, size):
+    """Merge messages sharing the same options into multi-tiles messages."""
+    groups = {}
+    for source, decoded in messages:
+        for message in decoded:
+            options = {k: v for k, v in message.items() if k != "tile"}
+            group = groups.setdefault(json.dumps(options, sort_keys=True), [])
+            group.append((source, message["tile"]))
+
+    entries = []
+    for options, tiles in groups.items():
+        for part in _chunks(tiles, size):
+            sources = {s["MessageId"]: s for s, _ in part}
+            m = {**json.loads(options), "tiles": [tile for _, tile in part]}
+            entries.append((json.dumps({"Message": json.dumps(m)}), sources))
+
+    return entries
+
+
+def redrive_messages(client, queue_url, messages, merge=1):
+    """Send messages back to the queue and return the sent source messages."""
+    if merge > 1:
+        entries = _merge_messages(messages, merge)
+    else:
+        entries = []
+        for source, decoded in messages:
+            if len(decoded) == len(decode(source["Body"])):
+                body = source["Body"]
+            else:  # some tiles were skipped, only send the others
+                body = _merge_messages([(source, decoded)], len(decoded))[0][0]
+            entries.append((body, {source["MessageId"]: source}))
+
+    # A source message can only be deleted once all its tiles were sent
+    sent, failed = {}, set()
+    for part in _chunks(list(enumerate(entries)), 10):
+        response = client.send_message_batch(
+            QueueUrl=queue_url,
+            Entries=[{"Id": str(i), "MessageBody": body} for i, (body, _) in part],
+        )
+        ok = {e["Id"] for e in response.get("Successful", [])}
+        for i, (_, sources) in part:
+            if str(i) in ok:
+                sent.update(sources)
+            else:
+                failed.update(sources)
+
+    return [m for mid, m in sent.items() if mid not in failed]
+
+
+def _delete_messages(client, queue_url, messages):
+    for part in _chunks(messages, 10):
+        client.delete_message_batch(
+            QueueUrl=queue_url,
+            Entries=[
+                {"Id": str(i), "ReceiptHandle": m["ReceiptHandle"]}
+                for i, m in enumerate(part)
+            ],
+        )
+
+
+def _release_messages(client, queue_url, messages):
+    for part in _chunks(messages, 10):
+        client.change_message_visibility_batch(
+            QueueUrl=queue_url,
+            Entries=[
+                {
+                    "Id": str(i),
+                    "ReceiptHandle": m["ReceiptHandle"],
+                    "VisibilityTimeout": 0,
+                }
+                for i, m in enumerate(part)
+            ],
+        )
+
+
+def replay_messages(
+    client,
+    dlq_url,
+    queue_url,
+    s3_client=None,
+    bucket=None,
+    merge=1,
+    batch_size=100,
+    limit=None,
+    dry_run=False,
+    visibility_timeout=300,
+):
+    """Drain a dead letter queue, classify and re-drive failed messages.
+
+    `client` (and `s3_client`) only need the SQS (and S3) methods used here,
+    so any local stand-in can be used.
+
+    Messages left in the queue (dry run, invalid or not re-driven) become
+    visible again and can be received twice: they are only counted once, and
+    the run stops after the number of messages available when it started, or
+    when receiving brings no new message.
+
+    Returns counts by class and counts of re-driven tiles by (dataset, zoom).
+
+    """
+    classes = Counter()
+    retries = Counter()
+    seen = set()
+
+    attrs = client.get_queue_attributes(
+        QueueUrl=dlq_url, AttributeNames=["ApproximateNumberOfMessages"]
+    )
+    available = int(attrs["Attributes"]["ApproximateNumberOfMessages"])
+    limit = min(limit, available) if limit else available
+
+    stale = 0
+    while len(seen) < limit and stale < 3:
+        received, repeated = [], []
+        while len(received) < batch_size and len(seen) < limit:
+            response = client.receive_message(
+                QueueUrl=dlq_url,
+                MaxNumberOfMessages=10,
+                VisibilityTimeout=visibility_timeout,
+                WaitTimeSeconds=1,
+            )
+            messages = response.get("Messages", [])
+            new = [m for m in messages if m["MessageId"] not in seen]
+            repeated.extend(m for m in messages if m["MessageId"] in seen)
+            seen.update(m["MessageId"] for m in new)
+            received.extend(new)
+            if not new:
+                break
+
+        if dry_run:
+            _release_messages(client, dlq_url, repeated)
+
+        if not received:
+            if not repeated:
+                break
+            stale += 1
+            continue
+        stale = 0
+
+        retry, done = [], []
+        for source in received:
+            cls, decoded = classify_message(source["Body"], s3_client, bucket)
+            classes[cls] += 1
+            if cls == "retry":
+                retry.append((source, decoded))
+                for m in decoded:
+                    retries[(m["dataset"], int(m["tile"].split("-")[0]))] += 1
+            elif cls == "exists":
+                done.append(source)
+
+        if dry_run:
+            # Make the messages visible again right away
+            _release_messages(client, dlq_url, received)
+            continue
+
+        sent = redrive_messages(client, queue_url, retry, merge=merge)
+        _delete_messages(client, dlq_url, done + sent)
+
+    return classes, retries
+
+
+@click.group()
+def cli():
+    """Tilebot jobs."""
+
+
+@cli.command()
 @click.argument("tiles", default="-", type=click.File("r"))
 @click.option("--dataset", type=str, required=True)
 @click.option("--reader", type=str)
@@ -34,12 +267,20 @@ def sns_worker(messages, topic, subject=None):
 @click.option("--expression", type=str)
 @click.option("--pixel-selection", type=str)
 @click.option("--topic", type=str, required=True, help="SNS Topic")
-def cli(tiles, dataset, reader, layers, expression, pixel_selection, topic):
+@click.option("--job", type=str, help="Job ID (default to a random uuid)")
+@click.option(
+    "--metrics",
+    type=click.Path(dir_okay=False),
+    help="SQLite metrics database where to register the job.",
+)
+def send(
+    tiles, dataset, reader, layers, expression, pixel_selection, topic, job, metrics
+):
     """
     Example:
     cat LaMyViet.geojson| supermercado burn 14 | xt -d'-' > list_z14.txt
 
-    cat list.txt | python -m create_jobs - \
+    cat list.txt | python -m create_jobs send - \
         --dataset mosaicid://mydataset \
         --expression "B02,B8A,B11,B12,(B08 - B04) / (B08 + B04),1.5 * (B08-B04) / (0.5 + B08 + B04)" \
         --topic arn:aws:sns:us-west-2:1111111111:tilebot-lambda-production-TopicAAAAAAAAAAAAAAAAAA
@@ -47,7 +288,7 @@ def cli(tiles, dataset, reader, layers, expression, pixel_selection, topic):
     """
 
     def _create_message(tile):
-        m = {"tile": tile.rstrip(), "dataset": dataset}
+        m = {"tile": tile.rstrip(), "dataset": dataset, "job": job}
         if layers:
             m.update({"indexes": layers})
         if expression:
@@ -59,13 +300,398 @@ def cli(tiles, dataset, reader, layers, expression, pixel_selection, topic):
 
         return m
 
+    job = job or str(uuid.uuid4())
     messages = [_create_message(tile) for tile in tiles]
 
+    if metrics:
+        # process() records one status per (tile, dataset) output
+        ndatasets = len(dataset.split(","))
+        totals = Counter(int(m["tile"].split("-")[0]) for m in messages)
+        SQLiteSink(metrics).write_job(
+            job, {zoom: count * ndatasets for zoom, count in totals.items()}
+        )
+
+    click.echo(f"Sending {len(messages)} messages for job {job}", err=True)
+
     parts = _chunks(messages, 50)
     _send_message = partial(sns_worker, topic=topic)
     with futures.ThreadPoolExecutor(max_workers=50) as executor:
         executor.map(_send_message, parts)
 
 
+@cli.command()
+@click.argument("job", type=str)
+@click.option(
+    "--metrics",
+    type=click.Path(exists=True, dir_okay=False),
+    help="SQLite metrics database (counters, or totals with --cloudwatch).",
+)
+@click.option(
+    "--cloudwatch",
+    is_flag=True,
+    help="Read counters from the CloudWatch metrics (METRICS_SINK=emf).",
+)
+@click.option(
+    "--namespace", type=str, default="tilebot", show_default=True,
+)
+@click.option(
+    "--since",
+    type=float,
+    default=14 * 24,
+    show_default=True,
+    help="With --cloudwatch, hours of metrics to read.",
+)
+@click.option("--region", type=str, help="AWS region.")
+def status(job, metrics, cloudwatch, namespace, since, region):
+    """Report job progress, throughput and ETA."""
+    if not metrics and not cloudwatch:
+        raise click.UsageError("--metrics or --cloudwatch is required")
+
+    if cloudwatch:
+        client = boto3_session(region_name=region).client("cloudwatch")
+        info = read_cloudwatch(job, namespace, since=since * 3600, client=client)
+        if metrics:
+            info["totals"] = SQLiteSink(metrics).read(job)["totals"]
+    else:
+        info = SQLiteSink(metrics).read(job)
+
+    totals = info["totals"]
+    counters = info["counters"]
+
+    click.echo(
+        "{:>4} {:>10} {:>10} {:>10} {:>10} {:>10} {:>8}".format(
+            "zoom", "total", *STATUSES, "complete"
+        )
+    )
+    # Failed outputs are retried (or dead-lettered), they are not complete.
+    completed = [s for s in STATUSES if s != "failed"]
+    processed = 0
+    for zoom in sorted(set(totals) | set(counters)):
+        zc = counters.get(zoom, {})
+        count = sum(zc.get(s, 0) for s in completed)
+        processed += count
+        total = totals.get(zoom)
+        pct = f"{100 * count / total:.1f}%" if total else "-"
+        click.echo(
+            "{:>4} {:>10} {:>10} {:>10} {:>10} {:>10} {:>8}".format(
+                zoom, total or "-", *[zc.get(s, 0) for s in STATUSES], pct
+            )
+        )
+
+    nbytes = sum(zc["bytes"] for zc in counters.values())
+    click.echo(f"Bytes written: {nbytes}")
+
+    if not processed:
+        return
+
+    elapsed = max(info["last"] - info["first"], 1e-6)
+    rate = processed / elapsed
+    click.echo(f"Throughput: {rate:.2f} tiles/s")
+
+    remaining = sum(totals.values()) - processed
+    if totals and remaining > 0:
+        eta = remaining / rate
+        click.echo(
+            f"ETA: {eta:.0f}s ({time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(time.time() + eta))})"
+        )
+
+
+@cli.command()
+@click.argument("dlq", type=str)
+@click.option(
+    "--queue", type=str, required=True, help="SQS Queue URL to re-drive messages to."
+)
+@click.option(
+    "--merge",
+    type=int,
+    default=1,
+    show_default=True,
+    help="Number of tiles per re-driven message.",
+)
+@click.option(
+    "--skip-existing",
+    is_flag=True,
+    help="Drop messages whose output tiles already exist.",
+)
+@click.option("--bucket", type=str, envvar="OUTPUT_BUCKET", help="Output bucket.")
+@click.option("--batch-size", type=int, default=100, show_default=True)
+@click.option("--limit", type=int, help="Maximum number of messages to replay.")
+@click.option("--dry-run", is_flag=True, help="Only classify messages.")
+@click.option("--region", type=str, default="us-west-2", show_default=True)
+def replay(
+    dlq, queue, merge, skip_existing, bucket, batch_size, limit, dry_run, region
+):
+    """
+    Re-drive messages from a Dead Letter Queue.
+
+    Example:
+    python -m create_jobs replay https://sqs.us-west-2.amazonaws.com/1111111111/tilebot-dlq \
+        --queue https://sqs.us-west-2.amazonaws.com/1111111111/tilebot-queue \
+        --merge 10 --skip-existing --bucket mybucket-us-west-2
+
+    """
+    if skip_existing and not bucket:
+        raise click.UsageError("--skip-existing requires --bucket")
+
+    session = boto3_session(region_name=region)
+    s3_client = session.client("s3") if skip_existing else None
+
+    classes, retries = replay_messages(
+        session.client("sqs"),
+        dlq,
+        queue,
+        s3_client=s3_client,
+        bucket=bucket,
+        merge=merge,
+        batch_size=batch_size,
+        limit=limit,
+        dry_run=dry_run,
+    )
+
+    for cls, count in sorted(classes.items()):
+        click.echo(f"{cls}: {count}")
+
+    for (dataset, zoom), count in sorted(retries.items()):
+        click.echo(f"  {dataset} z{zoom}: {count} tiles")
+
+
+@lru_cache(maxsize=1)
+def _stack_settings_class():
+    spec = importlib.util.spec_from_file_location(
+        "_stack_config", os.path.join(STACK_DIR, "config.py")
+    )
+    module = importlib.util.module_from_spec(spec)
+    try:
+        spec.loader.exec_module(module)  # type: ignore
+    except pydantic.ValidationError:
+        # The module level `stack_config` reads `stack/.env` relative to the
+        # working directory and requires settings we don't need here.
+        pass
+
+    return module.StackSettings  # type: ignore
+
+
+def stack_settings():
+    """Load the stack settings (STACK_* variables and stack/.env)."""
+    settings = _stack_settings_class()
+    required = {k: "" for k, field in settings.__fields__.items() if field.required}
+    return settings(_env_file=os.path.join(STACK_DIR, ".env"), **required)
+
+
+def _fmt_duration(seconds):
+    hours, rest = divmod(int(seconds), 3600)
+    return f"{hours}h{rest // 60:02d}m"
+
+
+@cli.command()
+@click.argument("tiles", default="-", type=click.File("r"))
+@click.option("--dataset", type=str, required=True)
+@click.option("--reader", type=str)
+@click.option("--layers", type=str)
+@click.option("--expression", type=str)
+@click.option("--pixel-selection", type=str)
+@click.option(
+    "--sample",
+    type=int,
+    default=200,
+    show_default=True,
+    help="Number of tiles used to resolve mosaic asset counts.",
+)
+@click.option(
+    "--measure",
+    type=int,
+    default=0,
+    show_default=True,
+    help="Number of sampled tiles to process locally to measure time and size.",
+)
+@click.option(
+    "--seconds-per-tile",
+    type=float,
+    default=2.0,
+    show_default=True,
+    help="Tile processing time, when not measured.",
+)
+@click.option(
+    "--bytes-per-tile",
+    type=int,
+    default=500000,
+    show_default=True,
+    help="Output size, when not measured.",
+)
+@click.option(
+    "--gets-per-asset",
+    type=int,
+    default=4,
+    show_default=True,
+    help="S3 GET (range) requests per asset read.",
+)
+@click.option("--lambda-memory", type=int, help="Default to STACK_MEMORY.")
+@click.option("--lambda-concurrency", type=int, help="Default to STACK_MAX_CONCURRENT.")
+@click.option("--ecs-tasks", type=int, help="Default to STACK_MAX_ECS_INSTANCES.")
+@click.option("--task-cpu", type=int, help="Default to STACK_TASK_CPU.")
+@click.option("--task-memory", type=int, help="Default to STACK_TASK_MEMORY.")
+@click.option("--seed", type=int, default=0, help="Sampling seed.")
+def plan(
+    tiles,
+    dataset,
+    reader,
+    layers,
+    expression,
+    pixel_selection,
+    sample,
+    measure,
+    seconds_per_tile,
+    bytes_per_tile,
+    gets_per_asset,
+    lambda_memory,
+    lambda_concurrency,
+    ecs_tasks,
+    task_cpu,
+    task_memory,
+    seed,
+):
+    """
+    Estimate the cost and duration of a job.
+
+    Lambda and ECS defaults follow the stack configuration (STACK_* environment
+    variables and stack/.env, see stack/config.py).
+
+    Example:
+    cat list_z14.txt | python -m create_jobs plan - \
+        --dataset mosaicid://mydataset \
+        --measure 20
+
+    """
+    tiles = [tile.strip() for tile in tiles if tile.strip()]
+    total = len(tiles)
+    if not total:
+        raise click.UsageError("No tiles")
+
+    try:
+        stack = stack_settings()
+    except pydantic.ValidationError as e:
+        raise click.ClickException(f"Invalid stack configuration: {e}")
+
+    lambda_memory = lambda_memory or stack.memory
+    lambda_concurrency = lambda_concurrency or stack.max_concurrent
+    ecs_tasks = ecs_tasks or stack.max_ecs_instances
+    task_cpu = task_cpu or stack.task_cpu
+    task_memory = task_memory or stack.task_memory
+
+    random.seed(seed)
+    sampled = random.sample(tiles, min(sample, total))
+    datasets = dataset.split(",")
+
+    # Number of assets per tile from the mosaic quadkey index
+    assets = []
+    for ds in datasets:
+        url, _ = _parse_dataset(ds)
+        if not url:
+            assets.extend(1 for _ in sampled)
+            continue
+
+        with MosaicBackend(url) as mosaic:
+            for tile in sampled:
+                z, x, y = map(int, tile.split("-"))
+                # Several quadkeys can list the same asset
+                assets.append(len(set(mosaic.assets_for_tile(x, y, z))))
+
+    assets_per_tile = sum(assets) / len(sampled)
+    with_assets = sum(1 for a in assets if a) / len(assets)
+
+    if measure:
+        options = {"dataset": dataset}
+        if layers:
+            options["indexes"] = layers
+        if expression:
+            options["expression"] = expression
+        if reader:
+            options["reader"] = reader
+        if pixel_selection:
+            options["pixel_selection"] = pixel_selection
+
+        timings = []
+        errors = {}
+        with tempfile.TemporaryDirectory() as tmpdir:
+            os.environ["OUTPUT_BUCKET"] = f"file://{tmpdir}"
+            for tile in sampled[:measure]:
+                t0 = time.time()
+                try:
+                    process({**options, "tile": tile})
+                except Exception as e:
+                    errors[tile] = repr(e)
+                    continue
+                timings.append(time.time() - t0)
+
+            outputs = [
+                os.path.getsize(os.path.join(root, f))
+                for root, _, files in os.walk(tmpdir)
+                for f in files
+            ]
+
+        for tile, error in list(errors.items())[:5]:
+            click.echo(f"{tile}: {error}", err=True)
+        if not timings:
+            raise click.ClickException(f"All {len(errors)} measured tiles failed")
+        if errors:
+            click.echo(
+                f"{len(errors)} of {len(errors) + len(timings)} measured tiles "
+                "failed, estimating from the others",
+                err=True,
+            )
+
+        seconds_per_tile = statistics.mean(timings)
+        # Per output, tiles without data are not written
+        bytes_per_tile = statistics.mean(outputs) if outputs else 0
+        written = len(outputs) / (len(timings) * len(datasets))
+        click.echo(
+            f"Measured {len(timings)} tiles: {seconds_per_tile:.2f}s/tile "
+            f"(p90 {sorted(timings)[int(0.9 * (len(timings) - 1))]:.2f}s), "
+            f"{bytes_per_tile / 1e3:.0f} kB/output"
+        )
+    else:
+        written = with_assets
+
+    puts = total * len(datasets) * written
+    gets = total * assets_per_tile * gets_per_asset
+    common = (
+        total * PRICES["sns_publish"]
+        + total * 3 * PRICES["sqs_request"]  # send, receive, delete
+        + puts * PRICES["s3_put"]
+        + gets * PRICES["s3_get"]
+    )
+
+    click.echo(f"Tiles: {total} ({len(datasets)} dataset(s))")
+    click.echo(
+        f"Assets per tile: {assets_per_tile:.2f} "
+        f"({100 * with_assets:.0f}% of tiles with assets)"
+    )
+    click.echo(
+        f"S3: {puts:.0f} PUT, {gets:.0f} GET, {puts * bytes_per_tile / 1e9:.1f} GB"
+    )
+
+    compute = total * seconds_per_tile
+    gb_seconds = compute * lambda_memory / 1024
+    lambda_cost = (
+        gb_seconds * PRICES["lambda_gb_second"] + total * PRICES["lambda_request"]
+    )
+    click.echo(
+        f"Lambda ({lambda_memory} MB x {lambda_concurrency}): "
+        f"{gb_seconds:.0f} GB-s, ${lambda_cost + common:.2f}, "
+        f"~{_fmt_duration(compute / lambda_concurrency)}"
+    )
+
+    task_hours = compute / 3600
+    ecs_cost = task_hours * (
+        task_cpu / 1024 * PRICES["fargate_vcpu_hour"]
+        + task_memory / 1024 * PRICES["fargate_gb_hour"]
+    )
+    click.echo(
+        f"ECS ({task_cpu} CPU / {task_memory} MB x {ecs_tasks}): "
+        f"{task_hours:.1f} task-hours, ${ecs_cost + common:.2f}, "
+        f"~{_fmt_duration(compute / ecs_tasks)}"
+    )
+
+
 if __name__ == "__main__":
     cli()
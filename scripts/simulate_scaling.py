@@ -0,0 +1,208 @@
+"""simulate_scaling: Replay ECS scaling decisions from recorded metrics."""
+
+import json
+import math
+
+import click
+
+
+def backlog_seconds(visible, inflight, running, tps):
+    """BacklogSecondsPerTask metric (see stack/watchbot.py)."""
+    return (visible + inflight) / (max(running, 1) * tps)
+
+
+def target_tracking(capacity, metric, target):
+    """Capacity proposed by a target tracking policy."""
+    return math.ceil(capacity * metric / target)
+
+
+def simulate(
+    records,
+    target_backlog=300,
+    default_tps=1.0,
+    mincount=0,
+    maxcount=50,
+    scaling_steps=5,
+    period=60,
+    scale_out_cooldown=120,
+    scale_in_cooldown=300,
+    batch_size=1,
+    scale_out_evaluation=180,
+    scale_in_evaluation=900,
+    scale_in_ratio=0.9,
+):
+    """
+    Replay scaling decisions.
+
+    Each record is a dict of recorded metrics for one `period`:
+        - visible: ApproximateNumberOfMessages (used when `sent` is missing)
+        - inflight: ApproximateNumberOfMessagesNotVisible (optional)
+        - sent: number of new messages (the queue is then simulated, each
+          running task holding `batch_size` messages in flight)
+        - tps: observed TilesPerSecondPerTask (optional)
+
+    Like the CloudWatch alarms created by target tracking, the service only
+    scales out once the metric stayed above the target for
+    `scale_out_evaluation` seconds (3 datapoints), and only scales in once it
+    stayed below `scale_in_ratio` of the target for `scale_in_evaluation`
+    seconds (15 datapoints).
+
+    Yields one dict per record with the simulated state.
+
+    """
+    desired = running = mincount
+    backlog = None
+    tps = default_tps
+    last_out = last_in = -math.inf
+    out_periods = max(math.ceil(scale_out_evaluation / period), 1)
+    in_periods = max(math.ceil(scale_in_evaluation / period), 1)
+    history = []
+
+    for t, record in enumerate(records):
+        now = t * period
+        tps = record.get("tps") or tps
+
+        if "sent" in record:
+            if backlog is None:
+                backlog = record.get("visible", 0) + record.get("inflight", 0)
+            backlog += record["sent"]
+            inflight = min(backlog, running * batch_size)
+            visible = backlog - inflight
+        else:
+            visible = record["visible"]
+            inflight = record.get("inflight", 0)
+
+        metric = backlog_seconds(visible, inflight, running, tps)
+        history.append(metric)
+        high = len(history) >= out_periods and all(
+            m > target_backlog for m in history[-out_periods:]
+        )
+        low = len(history) >= in_periods and all(
+            m < scale_in_ratio * target_backlog for m in history[-in_periods:]
+        )
+
+        action = None
+        if desired == 0 and visible > 0:
+            if now - last_out >= scale_out_cooldown:
+                desired = min(desired + scaling_steps, maxcount)
+                last_out = now
+                action = "wake"
+        else:
+            proposed = min(
+                max(target_tracking(desired, metric, target_backlog), mincount),
+                maxcount,
+            )
+            if high and proposed > desired and now - last_out >= scale_out_cooldown:
+                desired = proposed
+                last_out = now
+                action = "out"
+            elif low and proposed < desired and now - last_in >= scale_in_cooldown:
+                desired = proposed
+                last_in = now
+                action = "in"
+
+        yield {
+            "time": now,
+            "visible": visible,
+            "inflight": inflight,
+            "running": running,
+            "tps": tps,
+            "metric": metric,
+            "desired": desired,
+            "action": action,
+        }
+
+        # New tasks are running at the next period
+        if "sent" in record:
+            backlog = max(backlog - running * tps * period, 0)
+        running = desired
+
+
+@click.command()
+@click.argument("records", default="-", type=click.File("r"))
+@click.option("--target-backlog", type=int, default=300, show_default=True)
+@click.option("--tiles-per-second", type=float, default=1.0, show_default=True)
+@click.option("--mincount", type=int, default=0, show_default=True)
+@click.option("--maxcount", type=int, default=50, show_default=True)
+@click.option("--scaling-steps", type=int, default=5, show_default=True)
+@click.option("--period", type=int, default=60, show_default=True)
+@click.option(
+    "--batch-size",
+    type=int,
+    default=1,
+    show_default=True,
+    help="Messages held in flight by each simulated task (WORKER_BATCH_SIZE).",
+)
+@click.option(
+    "--scale-out-evaluation",
+    type=int,
+    default=180,
+    show_default=True,
+    help="Seconds above target before scaling out.",
+)
+@click.option(
+    "--scale-in-evaluation",
+    type=int,
+    default=900,
+    show_default=True,
+    help="Seconds below 90% of the target before scaling in.",
+)
+def cli(
+    records,
+    target_backlog,
+    tiles_per_second,
+    mincount,
+    maxcount,
+    scaling_steps,
+    period,
+    batch_size,
+    scale_out_evaluation,
+    scale_in_evaluation,
+):
+    """
+    Example:
+    cat metrics.jsonl | python -m simulate_scaling - --target-backlog 300
+
+    Where each line is `{"visible": 1000, "inflight": 20, "tps": 0.8}` or
+    `{"sent": 200}`.
+
+    """
+    states = simulate(
+        (json.loads(line) for line in records if line.strip()),
+        target_backlog=target_backlog,
+        default_tps=tiles_per_second,
+        mincount=mincount,
+        maxcount=maxcount,
+        scaling_steps=scaling_steps,
+        period=period,
+        batch_size=batch_size,
+        scale_out_evaluation=scale_out_evaluation,
+        scale_in_evaluation=scale_in_evaluation,
+    )
+
+    task_seconds = 0
+    drained = None
+    for state in states:
+        click.echo(
+            "{time:>7} visible={visible:<9.0f} inflight={inflight:<6.0f} "
+            "running={running:<4} tps={tps:<6.2f} "
+            "backlog/task={metric:<9.1f} desired={desired:<4} {action}".format(
+                **{**state, "action": state["action"] or ""}
+            )
+        )
+        task_seconds += state["running"] * period
+        if (
+            drained is None
+            and state["time"]
+            and not state["visible"]
+            and not state["inflight"]
+        ):
+            drained = state["time"]
+
+    click.echo(f"Task-seconds: {task_seconds}")
+    if drained is not None:
+        click.echo(f"Queue drained after {drained}s")
+
+
+if __name__ == "__main__":
+    cli()
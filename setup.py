@@ -11,6 +11,7 @@ inst_reqs = [
 
 extra_reqs = {
     "test": ["pytest", "pytest-cov"],
+    "speedups": ["orjson"],
     "deploy": [
         "aws-cdk.core==1.76.0",
         "aws-cdk.aws_lambda==1.76.0",
@@ -22,6 +23,7 @@ extra_reqs = {
         "aws-cdk.aws_ecr_assets==1.76.0",
         "aws-cdk.aws_autoscaling==1.76.0",
         "aws-cdk.aws_ecs_patterns==1.76.0",
+        "python-dotenv",
     ],
 }
 
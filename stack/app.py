@@ -20,6 +20,7 @@ env = dict(
     VSI_CACHE_SIZE="5000000",
     MOSAIC_CONCURRENCY="1",
     MAX_THREADS="2",
+    METRICS_SINK="emf",
 )
 env.update(
     dict(
@@ -88,6 +89,12 @@ ECS(
     mincount=stack_config.min_ecs_instances,
     maxcount=stack_config.max_ecs_instances,
     scaling_steps=stack_config.ecs_scaling_step,
+    target_backlog=stack_config.ecs_target_backlog,
+    default_throughput=stack_config.ecs_tiles_per_second,
+    visibility_timeout=stack_config.ecs_visibility_timeout,
+    tile_timeout=stack_config.ecs_tile_timeout,
+    stop_timeout=stack_config.ecs_stop_timeout,
+    spot=stack_config.ecs_spot,
     permissions=perms,
     vpc_id=stack_config.vpcId,
     vpc_is_default=stack_config.default_vpc,
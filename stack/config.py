@@ -28,6 +28,18 @@ class StackSettings(pydantic.BaseSettings):
     min_ecs_instances: int = 0
     max_ecs_instances: int = 50
     ecs_scaling_step: Optional[int]
+    # Seconds of queued work per task the service should scale to
+    ecs_target_backlog: int = 300
+    # Tiles per second per task used until workers have published any
+    ecs_tiles_per_second: float = 1.0
+    # SQS visibility timeout, extended by the workers while processing a tile
+    ecs_visibility_timeout: int = 120
+    # Maximum time to process one tile before the message is released
+    ecs_tile_timeout: int = 900
+    # Time given to a task to finish its tile after SIGTERM (2 to 120 on Fargate)
+    ecs_stop_timeout: int = 120
+    # Run the tasks (above min_ecs_instances) on Fargate Spot
+    ecs_spot: bool = False
 
     # CPU value      |   Memory value
     # 256 (.25 vCPU) | 0.5 GB, 1 GB, 2 GB
@@ -66,5 +78,13 @@ class StackSettings(pydantic.BaseSettings):
 
         return v or int(max_instances / 10)
 
+    @pydantic.validator("ecs_stop_timeout")
+    def validate_stop_timeout(cls, v) -> int:
+        """Validate container stop timeout."""
+        if v < 2 or v > 120:
+            raise ValueError("Stop timeout must be between 2 and 120 seconds")
+
+        return v
+
 
 stack_config = StackSettings()
@@ -101,6 +101,13 @@ class ECS(core.Stack):
         mincount: int = 0,
         maxcount: int = 50,
         scaling_steps: int = 5,
+        target_backlog: int = 300,
+        default_throughput: float = 1.0,
+        metrics_namespace: str = "tilebot",
+        visibility_timeout: int = 120,
+        tile_timeout: int = 900,
+        stop_timeout: int = 120,
+        spot: bool = False,
         permissions: Optional[List[iam.PolicyStatement]] = None,
         vpc_id: Optional[str] = None,
         vpc_is_default: Optional[bool] = None,
@@ -137,6 +144,7 @@ class ECS(core.Stack):
         queue = sqs.Queue(
             self,
             "ecsQueue",
+            visibility_timeout=core.Duration.seconds(visibility_timeout),
             dead_letter_queue=sqs.DeadLetterQueue(queue=dlqueue, max_receive_count=3),
         )
         core.CfnOutput(
@@ -147,7 +155,17 @@ class ECS(core.Stack):
             export_name=f"{id}-SQSQueueURL",
         )
 
-        environment.update({"REGION": self.region, "QUEUE_NAME": queue.queue_name})
+        environment.update(
+            {
+                "REGION": self.region,
+                "QUEUE_NAME": queue.queue_name,
+                "METRICS_NAMESPACE": metrics_namespace,
+                "WORKER_VISIBILITY_TIMEOUT": str(visibility_timeout),
+                "WORKER_HEARTBEAT_INTERVAL": str(max(visibility_timeout // 4, 1)),
+                "WORKER_TILE_TIMEOUT": str(tile_timeout),
+                "WORKER_SHUTDOWN_GRACE": str(max(stop_timeout - 10, 1)),
+            }
+        )
 
         topic.add_subscription(sns_sub.SqsSubscription(queue))
 
@@ -165,6 +183,7 @@ class ECS(core.Stack):
             entry_point=entrypoint,
             environment=environment,
             logging=log_driver,
+            stop_timeout=core.Duration.seconds(stop_timeout),
         )
 
         fargate_service = ecs.FargateService(
@@ -176,35 +195,92 @@ class ECS(core.Stack):
             enable_ecs_managed_tags=True,
             assign_public_ip=True,
         )
+        if spot:
+            # Keep `mincount` tasks on regular Fargate, scale on Fargate Spot
+            cluster.node.default_child.add_property_override(
+                "CapacityProviders", ["FARGATE", "FARGATE_SPOT"]
+            )
+            cfn_service = fargate_service.node.default_child
+            cfn_service.add_deletion_override("Properties.LaunchType")
+            cfn_service.add_property_override(
+                "CapacityProviderStrategy",
+                [
+                    {"CapacityProvider": "FARGATE", "Base": mincount, "Weight": 0},
+                    {"CapacityProvider": "FARGATE_SPOT", "Weight": 1},
+                ],
+            )
         permissions.append(
             iam.PolicyStatement(actions=["sqs:*"], resources=[queue.queue_arn],)
         )
+        permissions.append(
+            iam.PolicyStatement(actions=["cloudwatch:PutMetricData"], resources=["*"],)
+        )
         for perm in permissions:
             fargate_service.task_definition.task_role.add_to_policy(perm)
 
         total_number_of_message_lambda = aws_lambda.Function(
             self,
             f"{id}-TotalMessagesLambda",
-            description="Create TotalNumberOfMessage metrics",
+            description="Create TotalNumberOfMessage and BacklogSecondsPerTask metrics",
             code=aws_lambda.Code.from_inline(
                 """const AWS = require('aws-sdk');
     exports.handler = function(event, context, callback) {
     const sqs = new AWS.SQS({ region: process.env.AWS_DEFAULT_REGION });
     const cw = new AWS.CloudWatch({ region: process.env.AWS_DEFAULT_REGION });
-    return sqs.getQueueAttributes({
-        QueueUrl: process.env.SQS_QUEUE_URL,
-        AttributeNames: ['ApproximateNumberOfMessagesNotVisible', 'ApproximateNumberOfMessages']
-    }).promise()
-    .then((attrs) => {
-        return cw.putMetricData({
-            Namespace: 'AWS/SQS',
-            MetricData: [{
-            MetricName: 'TotalNumberOfMessages',
-            Dimensions: [{ Name: 'QueueName', Value: process.env.SQS_QUEUE_NAME }],
-            Value: Number(attrs.Attributes.ApproximateNumberOfMessagesNotVisible) +
-                    Number(attrs.Attributes.ApproximateNumberOfMessages)
-            }]
-        }).promise();
+    const ecs = new AWS.ECS({ region: process.env.AWS_DEFAULT_REGION });
+    const dimensions = [{ Name: 'QueueName', Value: process.env.SQS_QUEUE_NAME }];
+    const now = new Date();
+    return Promise.all([
+        sqs.getQueueAttributes({
+            QueueUrl: process.env.SQS_QUEUE_URL,
+            AttributeNames: ['ApproximateNumberOfMessagesNotVisible', 'ApproximateNumberOfMessages']
+        }).promise(),
+        ecs.describeServices({
+            cluster: process.env.CLUSTER_NAME,
+            services: [process.env.SERVICE_NAME]
+        }).promise(),
+        cw.getMetricStatistics({
+            Namespace: process.env.METRICS_NAMESPACE,
+            MetricName: 'TilesPerSecondPerTask',
+            Dimensions: dimensions,
+            StartTime: new Date(now.getTime() - 10 * 60 * 1000),
+            EndTime: now,
+            Period: 300,
+            Statistics: ['Average']
+        }).promise()
+    ])
+    .then(([attrs, services, throughput]) => {
+        const visible = Number(attrs.Attributes.ApproximateNumberOfMessages);
+        const inflight = Number(attrs.Attributes.ApproximateNumberOfMessagesNotVisible);
+        const service = services.services[0] || { runningCount: 0, desiredCount: 0 };
+        const points = throughput.Datapoints.sort((a, b) => b.Timestamp - a.Timestamp);
+        const tps = points.length ? points[0].Average : Number(process.env.DEFAULT_TILES_PER_SECOND);
+        // Seconds needed by the running tasks to drain the queue, including the
+        // messages they are working on: otherwise a queue whose last messages
+        // are all in flight would look empty and scale the service in.
+        const backlog = (visible + inflight) / (Math.max(service.runningCount, 1) * tps);
+        return Promise.all([
+            cw.putMetricData({
+                Namespace: 'AWS/SQS',
+                MetricData: [{
+                MetricName: 'TotalNumberOfMessages',
+                Dimensions: dimensions,
+                Value: visible + inflight
+                }]
+            }).promise(),
+            cw.putMetricData({
+                Namespace: process.env.METRICS_NAMESPACE,
+                MetricData: [{
+                MetricName: 'BacklogSecondsPerTask',
+                Dimensions: dimensions,
+                Value: backlog
+                }, {
+                MetricName: 'BacklogWithoutTasks',
+                Dimensions: dimensions,
+                Value: service.desiredCount === 0 ? visible : 0
+                }]
+            }).promise()
+        ]);
     })
     .then((metric) => callback(null, metric))
     .catch((err) => callback(err));
@@ -216,6 +292,10 @@ class ECS(core.Stack):
             environment={
                 "SQS_QUEUE_URL": queue.queue_url,
                 "SQS_QUEUE_NAME": queue.queue_name,
+                "CLUSTER_NAME": cluster.cluster_name,
+                "SERVICE_NAME": fargate_service.service_name,
+                "METRICS_NAMESPACE": metrics_namespace,
+                "DEFAULT_TILES_PER_SECOND": str(default_throughput),
             },
         )
         total_number_of_message_lambda.add_to_role_policy(
@@ -224,7 +304,16 @@ class ECS(core.Stack):
             )
         )
         total_number_of_message_lambda.add_to_role_policy(
-            iam.PolicyStatement(actions=["cloudwatch:PutMetricData"], resources=["*"],)
+            iam.PolicyStatement(
+                actions=["ecs:DescribeServices"],
+                resources=[fargate_service.service_arn],
+            )
+        )
+        total_number_of_message_lambda.add_to_role_policy(
+            iam.PolicyStatement(
+                actions=["cloudwatch:PutMetricData", "cloudwatch:GetMetricStatistics"],
+                resources=["*"],
+            )
         )
         total_number_of_message_lambda.add_to_role_policy(
             iam.PolicyStatement(actions=["logs:*"], resources=["arn:aws:logs:*:*:*"],)
@@ -252,6 +341,33 @@ class ECS(core.Stack):
         )
         scalable_target.node.add_dependency(fargate_service)
 
+        # Keep the time needed to drain the queue (visible and in-flight messages
+        # divided by the observed throughput of the running tasks) around
+        # `target_backlog`.
+        auto_scale.CfnScalingPolicy(
+            self,
+            "BacklogTracking",
+            policy_name="PolicyBacklogTracking",
+            policy_type="TargetTrackingScaling",
+            scaling_target_id=scalable_target.scalable_target_id,
+            target_tracking_scaling_policy_configuration=auto_scale.CfnScalingPolicy.TargetTrackingScalingPolicyConfigurationProperty(
+                target_value=target_backlog,
+                customized_metric_specification=auto_scale.CfnScalingPolicy.CustomizedMetricSpecificationProperty(
+                    metric_name="BacklogSecondsPerTask",
+                    namespace=metrics_namespace,
+                    statistic="Average",
+                    dimensions=[
+                        auto_scale.CfnScalingPolicy.MetricDimensionProperty(
+                            name="QueueName", value=queue.queue_name,
+                        ),
+                    ],
+                ),
+                scale_out_cooldown=120,
+                scale_in_cooldown=300,
+            ),
+        )
+
+        # Target tracking cannot scale out from 0 tasks
         scale_up = auto_scale.CfnScalingPolicy(
             self,
             "ScaleUp",
@@ -272,14 +388,14 @@ class ECS(core.Stack):
         scale_up_trigger = aws_cloudwatch.CfnAlarm(  # noqa
             self,
             "ScaleUpTrigger",
-            alarm_description="Scale up due to visible messages in queue",
+            alarm_description="Scale up from zero due to visible messages in queue",
             dimensions=[
                 aws_cloudwatch.CfnAlarm.DimensionProperty(
                     name="QueueName", value=queue.queue_name,
                 ),
             ],
-            metric_name="ApproximateNumberOfMessagesVisible",
-            namespace="AWS/SQS",
+            metric_name="BacklogWithoutTasks",
+            namespace=metrics_namespace,
             evaluation_periods=1,
             comparison_operator="GreaterThanThreshold",
             period=60,
@@ -287,39 +403,3 @@ class ECS(core.Stack):
             threshold=0,
             alarm_actions=[scale_up.ref],
         )
-
-        scale_down = auto_scale.CfnScalingPolicy(
-            self,
-            "ScaleDown",
-            policy_name="PolicyScaleDown",
-            policy_type="StepScaling",
-            scaling_target_id=scalable_target.scalable_target_id,
-            step_scaling_policy_configuration=auto_scale.CfnScalingPolicy.StepScalingPolicyConfigurationProperty(
-                adjustment_type="ExactCapacity",
-                cooldown=60,
-                step_adjustments=[
-                    auto_scale.CfnScalingPolicy.StepAdjustmentProperty(
-                        scaling_adjustment=mincount, metric_interval_upper_bound=0,
-                    ),
-                ],
-            ),
-        )
-
-        scale_down_trigger = aws_cloudwatch.CfnAlarm(  # noqa
-            self,
-            "ScaleDownTrigger",
-            alarm_description="Scale down due to lack of in-flight messages in queue",
-            dimensions=[
-                aws_cloudwatch.CfnAlarm.DimensionProperty(
-                    name="QueueName", value=queue.queue_name,
-                ),
-            ],
-            metric_name="TotalNumberOfMessages",
-            namespace="AWS/SQS",
-            evaluation_periods=1,
-            comparison_operator="LessThanThreshold",
-            period=120,
-            statistic="Maximum",
-            threshold=1,
-            alarm_actions=[scale_down.ref],
-        )
@@ -0,0 +1,232 @@
+"""test tilebot.cache."""
+
+import numpy
+import pytest
+from morecantile import Tile
+from rio_tiler.models import ImageData
+
+from tilebot.cache import DatasetCache, WindowCache, cached_reader, window_cache
+
+
+class Dataset:
+    """Record enter/exit."""
+
+    def __init__(self, name):
+        self.name = name
+        self.opened = False
+        self.closed = False
+
+    def __enter__(self):
+        self.opened = True
+        return self
+
+    def __exit__(self, *args):
+        self.closed = True
+
+
+def test_dataset_cache():
+    """Should re-use opened datasets and exit evicted ones."""
+    cache = DatasetCache(maxsize=2)
+    datasets = {}
+
+    def factory(name):
+        def _open():
+            datasets[name] = Dataset(name)
+            return datasets[name]
+
+        return _open
+
+    with cache.open("a", factory("a")) as a:
+        assert a.opened
+    with cache.open("a", factory("a")) as src:
+        assert src is a
+    with cache.open("b", factory("b")):
+        pass
+    assert not a.closed
+
+    # "a" was used last, "b" is evicted
+    with cache.open("a", factory("a")):
+        pass
+    with cache.open("c", factory("c")):
+        pass
+    assert datasets["b"].closed
+    assert not a.closed
+    assert not datasets["c"].closed
+
+    cache.clear()
+    assert a.closed
+    assert datasets["c"].closed
+
+    with cache.open("a", factory("a")) as src:
+        assert src is not a
+        assert not src.closed
+
+
+def test_dataset_cache_in_use():
+    """Should only exit a dataset cleared while in use once released."""
+    cache = DatasetCache(maxsize=1)
+
+    with cache.open("a", lambda: Dataset("a")) as a:
+        cache.clear()
+        assert not a.closed
+
+        with cache.open("b", lambda: Dataset("b")) as b:
+            # Evicted while in use
+            with cache.open("c", lambda: Dataset("c")):
+                assert not b.closed
+            assert not b.closed
+        assert b.closed
+        assert not a.closed
+    assert a.closed
+
+
+def test_dataset_cache_error():
+    """Should release a dataset when the block raises."""
+    cache = DatasetCache(maxsize=1)
+
+    with pytest.raises(ValueError):
+        with cache.open("a", lambda: Dataset("a")) as a:
+            raise ValueError()
+
+    assert not a.closed
+    cache.clear()
+    assert a.closed
+
+
+def test_window_cache():
+    """Should evict least recently used items above max_bytes."""
+    cache = WindowCache(max_bytes=100)
+    cache.put("a", "A", 40)
+    cache.put("b", "B", 40)
+    assert cache.get("a") == "A"  # "b" is now the least recently used
+
+    cache.put("c", "C", 40)
+    assert cache.nbytes == 80
+    assert cache.get("b") is None
+    assert cache.get("a") == "A"
+    assert cache.get("c") == "C"
+    assert (cache.hits, cache.misses) == (3, 1)
+
+    # Replacing an item updates its size
+    cache.put("c", "C2", 60)
+    assert cache.nbytes == 100
+    assert cache.get("c") == "C2"
+
+    cache.put("d", "D", 100)
+    assert cache.nbytes == 100
+    assert cache.get("a") is None
+    assert cache.get("c") is None
+
+
+def test_window_cache_oversize():
+    """Should not cache items larger than the cache."""
+    cache = WindowCache(max_bytes=100)
+    cache.put("a", "A", 40)
+    cache.put("big", "BIG", 101)
+    assert cache.get("big") is None
+    assert cache.get("a") == "A"
+    assert cache.nbytes == 40
+
+    disabled = WindowCache(max_bytes=0)
+    disabled.put("a", "A", 1)
+    assert disabled.get("a") is None
+
+
+def test_window_cache_clear():
+    """Should empty the cache."""
+    cache = WindowCache(max_bytes=100)
+    cache.put("a", "A", 40)
+    cache.clear()
+    assert cache.nbytes == 0
+    assert cache.get("a") is None
+
+    cache.put("a", "A", 40)
+    assert cache.get("a") == "A"
+
+
+class TMS:
+    """Tile bounds."""
+
+    def xy_bounds(self, tile):
+        size = 1 << tile.z
+        return (
+            tile.x / size,
+            -(tile.y + 1) / size,
+            (tile.x + 1) / size,
+            -tile.y / size,
+        )
+
+
+class Reader:
+    """Synthetic reader, pixel values encode their position and resolution."""
+
+    tms = TMS()
+
+    def __init__(self, filepath=None):
+        self.filepath = filepath
+        self.reads = []
+
+    def tile_exists(self, z, x, y):
+        return True
+
+    def tile(self, tile_x, tile_y, tile_z, tilesize=256, **kwargs):
+        self.reads.append((tile_z, tile_x, tile_y, tilesize))
+        rows = numpy.arange(tile_y * tilesize, (tile_y + 1) * tilesize)
+        cols = numpy.arange(tile_x * tilesize, (tile_x + 1) * tilesize)
+        position = rows[:, None] * 100000 + cols[None, :]
+        resolution = numpy.full(position.shape, tilesize << tile_z)
+        data = numpy.stack([position, resolution]).astype("int64")
+        mask = numpy.where(position % 7, 255, 0).astype("uint8")
+        return ImageData(
+            data,
+            mask,
+            assets=[self.filepath],
+            bounds=self.tms.xy_bounds(Tile(tile_x, tile_y, tile_z)),
+            crs="epsg:3857",
+        )
+
+
+@pytest.fixture
+def windows(monkeypatch):
+    """Enable the window cache."""
+    monkeypatch.setattr(window_cache, "max_bytes", 10_000_000)
+    window_cache.clear()
+    yield window_cache
+    window_cache.clear()
+
+
+def test_cached_reader(windows):
+    """Should cut the 4 children of a parent window like direct reads."""
+    CachedReader = cached_reader(Reader, 1)
+    src = CachedReader("s3://bucket/cog.tif")
+
+    for x, y in [(300, 364), (301, 364), (300, 365), (301, 365)]:
+        tile = src.tile(x, y, 10, tilesize=64)
+        expected = Reader("s3://bucket/cog.tif").tile(x, y, 10, tilesize=64)
+        numpy.testing.assert_array_equal(tile.data, expected.data)
+        numpy.testing.assert_array_equal(tile.mask, expected.mask)
+        assert tile.bounds == expected.bounds
+
+    # One parent window read for the 4 tiles
+    assert src.reads == [(9, 150, 182, 128)]
+
+    # Tiles are copies, updating one doesn't change the cached window
+    tile.data[:] = 0
+    again = src.tile(301, 365, 10, tilesize=64)
+    assert again.data.any()
+
+
+def test_cached_reader_sources(windows):
+    """Should not share windows between sources, nor without a source."""
+    CachedReader = cached_reader(Reader, 1)
+
+    a = CachedReader("a.tif")
+    b = CachedReader("b.tif")
+    a.tile(300, 364, 10, tilesize=64)
+    assert b.tile(301, 364, 10, tilesize=64).assets == ["b.tif"]
+    assert b.reads == [(9, 150, 182, 128)]
+
+    anonymous = CachedReader()
+    anonymous.tile(300, 364, 10, tilesize=64)
+    anonymous.tile(301, 364, 10, tilesize=64)
+    assert anonymous.reads == [(10, 300, 364, 64), (10, 301, 364, 64)]
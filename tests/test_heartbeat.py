@@ -0,0 +1,57 @@
+"""test tilebot.heartbeat."""
+
+import threading
+import time
+
+from tilebot.heartbeat import Heartbeat
+
+
+class SQS:
+    """Record change_message_visibility_batch calls."""
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.calls = []
+
+    def change_message_visibility_batch(self, QueueUrl, Entries):
+        time.sleep(self.delay)
+        self.calls.append(
+            [(e["ReceiptHandle"], e["VisibilityTimeout"]) for e in Entries]
+        )
+        return {}
+
+
+def test_beat_release():
+    """Should extend tracked messages and release them."""
+    sqs = SQS()
+    heartbeat = Heartbeat(sqs, "queue", visibility_timeout=120, interval=30)
+    for i in range(12):
+        heartbeat.add(str(i), f"rh-{i}")
+
+    heartbeat.beat()
+    assert [len(c) for c in sqs.calls] == [10, 2]
+    assert all(v == 120 for c in sqs.calls for _, v in c)
+
+    sqs.calls = []
+    heartbeat.remove("0")
+    heartbeat.release(["1", "2", "unknown"])
+    assert sqs.calls == [[("rh-1", 0), ("rh-2", 0)]]
+
+    sqs.calls = []
+    heartbeat.beat()
+    assert len(sum(sqs.calls, [])) == 9
+
+
+def test_release_during_beat():
+    """Should not extend a message released while a beat is running."""
+    sqs = SQS(delay=0.2)
+    heartbeat = Heartbeat(sqs, "queue", visibility_timeout=120, interval=30)
+    heartbeat.add("1", "rh-1")
+
+    beat = threading.Thread(target=heartbeat.beat)
+    beat.start()
+    time.sleep(0.05)
+    heartbeat.release(["1"])
+    beat.join()
+
+    assert sqs.calls == [[("rh-1", 120)], [("rh-1", 0)]]
@@ -0,0 +1,54 @@
+"""test tilebot.memory."""
+
+from tilebot import memory
+from tilebot.memory import MemoryGuard
+
+
+def test_memory_guard(monkeypatch):
+    """Should halve concurrency above high and restore it below low watermark."""
+    used = {"rss": 0}
+    monkeypatch.setattr(memory, "rss", lambda: used["rss"])
+
+    cleared = []
+    guard = MemoryGuard(limit=1000, high_watermark=0.8, low_watermark=0.6)
+    guard.on_pressure(lambda: cleared.append(True))
+
+    used["rss"] = 500
+    assert guard.check() == 1.0
+    assert guard.concurrency(8) == 8
+
+    used["rss"] = 900
+    assert guard.check() == 0.5
+    assert guard.check() == 0.25
+    assert len(cleared) == 2
+    assert guard.concurrency(8) == 1  # 0.125, never below 1
+
+    # Between the watermarks, keep the current factor
+    used["rss"] = 700
+    assert guard.check() == 0.125
+    assert guard.check() == 0.125
+    assert len(cleared) == 3
+
+    used["rss"] = 500
+    assert guard.check() == 0.25
+    assert guard.check() == 0.5
+    assert guard.check() == 1.0
+    assert guard.check() == 1.0
+    assert len(cleared) == 3
+
+
+def test_memory_guard_floor(monkeypatch):
+    """Should never go below a 0.01 factor."""
+    monkeypatch.setattr(memory, "rss", lambda: 2000)
+    guard = MemoryGuard(limit=1000)
+    for _ in range(20):
+        guard.check()
+    assert guard.factor == 0.01
+
+
+def test_memory_guard_no_limit(monkeypatch):
+    """Should do nothing without a memory limit."""
+    monkeypatch.setattr(memory, "rss", lambda: 1 << 40)
+    guard = MemoryGuard(limit=None)
+    assert guard.check() == 1.0
+    assert guard.concurrency(4) == 4
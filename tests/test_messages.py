@@ -0,0 +1,121 @@
+"""test tilebot.messages."""
+
+import json
+
+import pytest
+from morecantile import Tile
+from pydantic import ValidationError
+
+from tilebot.messages import (
+    TEMPLATE_FIELDS,
+    Message,
+    _template,
+    decode,
+    parse,
+    parse_message,
+)
+
+message = {"tile": "9-150-182", "dataset": "s3://bucket/cog.tif", "job": "myjob"}
+
+
+def _sns(m):
+    return {"Type": "Notification", "Message": json.dumps(m)}
+
+
+def test_decode_raw():
+    """Should decode raw messages."""
+    assert decode(message) == [message]
+    assert decode(json.dumps(message)) == [message]
+    assert decode(json.dumps(message).encode()) == [message]
+
+
+def test_decode_sns():
+    """Should remove the SNS envelope."""
+    assert decode(_sns(message)) == [message]
+    assert decode(json.dumps(_sns(message))) == [message]
+    assert decode(json.dumps(_sns(message)).encode()) == [message]
+
+
+def test_decode_records():
+    """Should decode SQS and SNS batch events."""
+    other = {**message, "tile": "9-151-182"}
+    event = {
+        "Records": [
+            {"body": json.dumps(_sns(message))},
+            {"body": json.dumps(other)},
+            {"Sns": _sns(other)},
+        ]
+    }
+    assert decode(event) == [message, other, other]
+    assert decode(json.dumps(event).encode()) == [message, other, other]
+
+
+def test_decode_merged():
+    """Should split merged messages, one per tile."""
+    merged = {"tiles": ["9-150-182", "9-151-182"], "dataset": "s3://bucket/cog.tif"}
+    assert decode(merged) == [
+        {"tile": "9-150-182", "dataset": "s3://bucket/cog.tif"},
+        {"tile": "9-151-182", "dataset": "s3://bucket/cog.tif"},
+    ]
+    assert len(decode({"Records": [{"body": json.dumps(_sns(merged))}]})) == 2
+
+
+def test_decode_invalid():
+    """Should raise on invalid JSON."""
+    with pytest.raises(ValueError):
+        decode("{not json")
+
+
+def test_parse():
+    """Should return validated Messages."""
+    messages = parse(json.dumps(_sns(message)))
+    assert len(messages) == 1
+    assert isinstance(messages[0], Message)
+    assert messages[0].tile == Tile(150, 182, 9)
+    assert messages[0].dataset == "s3://bucket/cog.tif"
+    assert messages[0].job == "myjob"
+    assert messages[0].reader == "rio_tiler.io.COGReader"
+
+    m = parse_message({**message, "pixel_selection": "highest"})
+    assert m.pixel_selection.value == "highest"
+
+
+@pytest.mark.parametrize(
+    "tile", ["9-150", "9-150-a", "", None, 9],
+)
+def test_parse_invalid_tile(tile):
+    """Should raise a ValidationError for invalid tiles."""
+    with pytest.raises(ValidationError):
+        parse_message({**message, "tile": tile})
+
+
+def test_parse_invalid():
+    """Should raise on invalid messages."""
+    with pytest.raises(ValidationError):
+        parse_message({"tile": "9-150-182"})
+
+    with pytest.raises(ValidationError):
+        parse_message({**message, "pixel_selection": "brightest"})
+
+    with pytest.raises(TypeError):
+        parse_message(["9-150-182"])
+
+
+def test_parse_template():
+    """Should validate job options once and return distinct Messages."""
+    _template.cache_clear()
+
+    messages = parse({"tiles": ["9-150-182", "9-151-182"], **message})
+    assert _template.cache_info().misses == 1
+    assert _template.cache_info().hits == 1
+
+    first, second = messages
+    assert first is not second
+    assert first.tile == Tile(150, 182, 9)
+    assert second.tile == Tile(151, 182, 9)
+    assert first.dataset == second.dataset == "s3://bucket/cog.tif"
+
+    # The cached template is left untouched
+    values = [message.get(k) for k in TEMPLATE_FIELDS]
+    assert _template(*values).tile == Tile(0, 0, 0)
+    assert parse_message(message).tile == Tile(150, 182, 9)
@@ -0,0 +1,25 @@
+"""test create_jobs plan."""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "scripts"))
+
+import create_jobs  # noqa: E402
+
+
+def test_stack_settings(monkeypatch):
+    """Should read the Lambda and ECS sizes like stack/config.py."""
+    for name in list(os.environ):
+        if name.startswith("STACK_"):
+            monkeypatch.delenv(name)
+
+    stack = create_jobs.stack_settings()
+    assert stack.memory == 3008
+    assert stack.max_ecs_instances == 50
+
+    monkeypatch.setenv("STACK_MEMORY", "1024")
+    monkeypatch.setenv("STACK_TASK_CPU", "2048")
+    stack = create_jobs.stack_settings()
+    assert stack.memory == 1024
+    assert stack.task_cpu == 2048
@@ -0,0 +1,73 @@
+"""test tilebot.process."""
+
+import os
+
+import numpy
+import pytest
+
+from tilebot import process
+
+
+def _write(f):
+    numpy.savez_compressed(f, data=numpy.ones((3, 256, 256), dtype="uint8"))
+
+
+def _fail(f):
+    f.write(b"PK")
+    raise ValueError("encoding failed")
+
+
+def test_spool_upload_file(tmpdir):
+    """Should write the output to a local directory."""
+    nbytes = process._spool_upload(_write, f"file://{tmpdir}", "mosaic/9-1-1.npz")
+
+    path = os.path.join(tmpdir, "mosaic", "9-1-1.npz")
+    assert os.path.getsize(path) == nbytes
+    with numpy.load(path) as npz:
+        assert npz["data"].shape == (3, 256, 256)
+    assert os.listdir(os.path.join(tmpdir, "mosaic")) == ["9-1-1.npz"]
+
+
+def test_spool_upload_file_error(tmpdir):
+    """Should not leave a truncated output when the writer fails."""
+    with pytest.raises(ValueError, match="encoding failed"):
+        process._spool_upload(_fail, f"file://{tmpdir}", "mosaic/9-1-1.npz")
+
+    assert os.listdir(os.path.join(tmpdir, "mosaic")) == []
+
+
+def test_spool_upload_s3(monkeypatch):
+    """Should upload the temporary file and remove it."""
+    uploads = []
+
+    def _upload_file(path, bucket, key):
+        with numpy.load(path) as npz:
+            assert npz["data"].shape == (3, 256, 256)
+        uploads.append((path, bucket, key, os.path.getsize(path)))
+        return True
+
+    monkeypatch.setattr(process, "_s3_upload_file", _upload_file)
+
+    nbytes = process._spool_upload(_write, "mybucket", "mosaic/9-1-1.npz")
+    [(path, bucket, key, size)] = uploads
+    assert (bucket, key, size) == ("mybucket", "mosaic/9-1-1.npz", nbytes)
+    assert not os.path.exists(path)
+
+
+def test_spool_upload_s3_errors(monkeypatch):
+    """Should raise the writer or uploader error and remove the file."""
+    paths = []
+
+    def _upload_file(path, bucket, key):
+        paths.append(path)
+        raise ValueError("nope")
+
+    monkeypatch.setattr(process, "_s3_upload_file", _upload_file)
+
+    with pytest.raises(ValueError, match="nope"):
+        process._spool_upload(_write, "mybucket", "mosaic/9-1-1.npz")
+    assert not os.path.exists(paths[0])
+
+    with pytest.raises(ValueError, match="encoding failed"):
+        process._spool_upload(_fail, "mybucket", "mosaic/9-1-1.npz")
+    assert len(paths) == 1
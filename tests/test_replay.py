@@ -0,0 +1,297 @@
+"""test create_jobs replay."""
+
+import json
+import os
+import sys
+
+import pytest
+from botocore.exceptions import ClientError
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "scripts"))
+
+import create_jobs  # noqa: E402
+
+
+class SQS:
+    """Minimal SQS client, with one list of messages per queue url."""
+
+    def __init__(self, queues, fail=(), redeliver=False):
+        self.queues = queues
+        self.fail = set(fail)
+        # Released messages are received again first
+        self.redeliver = redeliver
+        self.inflight = {}
+        self.sent = []
+        self.deleted = []
+        self.released = []
+        self.batches = []
+
+    def get_queue_attributes(self, QueueUrl, AttributeNames):
+        n = len(self.queues[QueueUrl])
+        return {"Attributes": {"ApproximateNumberOfMessages": str(n)}}
+
+    def receive_message(self, QueueUrl, MaxNumberOfMessages=1, **kwargs):
+        queue = self.queues[QueueUrl]
+        messages = queue[:MaxNumberOfMessages]
+        del queue[:MaxNumberOfMessages]
+        for m in messages:
+            self.inflight[m["ReceiptHandle"]] = (QueueUrl, m)
+        return {"Messages": messages}
+
+    def send_message_batch(self, QueueUrl, Entries):
+        assert len(Entries) <= 10
+        self.batches.append(Entries)
+        successful, failed = [], []
+        for entry in Entries:
+            if entry["MessageBody"] in self.fail:
+                failed.append({"Id": entry["Id"], "SenderFault": False})
+            else:
+                successful.append({"Id": entry["Id"]})
+                self.sent.append(entry["MessageBody"])
+        return {"Successful": successful, "Failed": failed}
+
+    def delete_message_batch(self, QueueUrl, Entries):
+        assert len(Entries) <= 10
+        for entry in Entries:
+            self.inflight.pop(entry["ReceiptHandle"])
+            self.deleted.append(entry["ReceiptHandle"])
+
+    def change_message_visibility_batch(self, QueueUrl, Entries):
+        assert len(Entries) <= 10
+        for entry in Entries:
+            assert entry["VisibilityTimeout"] == 0
+            url, m = self.inflight.pop(entry["ReceiptHandle"])
+            if self.redeliver:
+                self.queues[url].insert(0, m)
+            else:
+                self.queues[url].append(m)
+            self.released.append(entry["ReceiptHandle"])
+
+
+class S3:
+    """Minimal S3 client."""
+
+    def __init__(self, keys):
+        self.keys = set(keys)
+
+    def head_object(self, Bucket, Key):
+        if Key not in self.keys:
+            raise ClientError({"Error": {"Code": "404"}}, "HeadObject")
+        return {}
+
+
+def _sqs_message(i, body):
+    if not isinstance(body, str):
+        body = json.dumps({"Message": json.dumps(body)})
+    return {"MessageId": f"id-{i}", "ReceiptHandle": f"rh-{i}", "Body": body}
+
+
+def _tile_message(i, tile, dataset="s3://bucket/cog.tif"):
+    return _sqs_message(i, {"tile": tile, "dataset": dataset})
+
+
+def test_classify():
+    """Should classify dead letter messages."""
+    s3 = S3({"cog/9-1-1.npz"})
+
+    body = json.dumps({"Message": json.dumps({"tile": "9-1-1", "dataset": "a.tif"})})
+    assert create_jobs.classify_message("{not json") == ("invalid-json", [])
+
+    cls, decoded = create_jobs.classify_message(json.dumps({"dataset": "a.tif"}))
+    assert cls == "invalid-message"
+
+    cls, decoded = create_jobs.classify_message(body)
+    assert cls == "retry"
+    assert decoded == [{"tile": "9-1-1", "dataset": "a.tif"}]
+
+    body = _tile_message(0, "9-1-1")["Body"]
+    assert create_jobs.classify_message(body, s3, "bucket")[0] == "exists"
+
+    body = _tile_message(0, "9-1-2")["Body"]
+    assert create_jobs.classify_message(body, s3, "bucket")[0] == "retry"
+
+    # Only the tiles of a merged message without output are retried
+    body = _sqs_message(
+        0, {"tiles": ["9-1-1", "9-1-2"], "dataset": "s3://bucket/cog.tif"}
+    )["Body"]
+    cls, decoded = create_jobs.classify_message(body, s3, "bucket")
+    assert cls == "retry"
+    assert decoded == [{"tile": "9-1-2", "dataset": "s3://bucket/cog.tif"}]
+
+    body = _sqs_message(
+        0, {"tiles": ["9-1-1", "9-1-1"], "dataset": "s3://bucket/cog.tif"}
+    )["Body"]
+    assert create_jobs.classify_message(body, s3, "bucket") == ("exists", [])
+
+    # A tile is only skipped if the outputs of all its datasets exist
+    body = _tile_message(0, "9-1-1", dataset="s3://bucket/cog.tif,other.tif")
+    cls, decoded = create_jobs.classify_message(body["Body"], s3, "bucket")
+    assert cls == "retry"
+    assert len(decoded) == 1
+
+
+def test_replay():
+    """Should re-drive retry messages and delete them from the DLQ."""
+    dlq = [
+        _tile_message(0, "9-1-1"),
+        _tile_message(1, "9-1-2"),
+        _sqs_message(2, "{not json"),
+        _sqs_message(3, {"dataset": "s3://bucket/cog.tif"}),
+    ]
+    sqs = SQS({"dlq": list(dlq), "queue": []})
+    s3 = S3({"cog/9-1-1.npz"})
+
+    classes, retries = create_jobs.replay_messages(
+        sqs, "dlq", "queue", s3_client=s3, bucket="bucket"
+    )
+    assert classes == {"exists": 1, "retry": 1, "invalid-json": 1, "invalid-message": 1}
+    assert retries == {("s3://bucket/cog.tif", 9): 1}
+    assert sqs.sent == [dlq[1]["Body"]]
+    assert sorted(sqs.deleted) == ["rh-0", "rh-1"]
+    assert not sqs.released
+
+
+def test_replay_dry_run():
+    """Should only classify and release the messages."""
+    dlq = [_tile_message(i, f"9-1-{i}") for i in range(25)]
+    sqs = SQS({"dlq": list(dlq), "queue": []})
+
+    classes, retries = create_jobs.replay_messages(
+        sqs, "dlq", "queue", batch_size=10, limit=25, dry_run=True
+    )
+    assert classes == {"retry": 25}
+    assert not sqs.sent
+    assert not sqs.deleted
+    assert set(sqs.released) == {m["ReceiptHandle"] for m in dlq}
+    assert not sqs.inflight
+    assert len(sqs.queues["dlq"]) == 25
+
+
+def test_redrive_merge():
+    """Should merge tiles sharing the same options in batches of 10."""
+    messages = []
+    for i in range(23):
+        source = _tile_message(i, f"9-1-{i}")
+        messages.append((source, create_jobs.decode(source["Body"])))
+    other = _tile_message(23, "9-1-23", dataset="s3://bucket/other.tif")
+    messages.append((other, create_jobs.decode(other["Body"])))
+
+    sqs = SQS({"queue": []})
+    sent = create_jobs.redrive_messages(sqs, "queue", messages, merge=5)
+    assert len(sent) == 24
+
+    # 23 tiles in 5 messages + 1 message for the other dataset
+    assert len(sqs.sent) == 6
+    assert [len(b) for b in sqs.batches] == [6]
+
+    tiles = []
+    for body in sqs.sent:
+        decoded = create_jobs.decode(body)
+        assert len(decoded) <= 5
+        assert len({m["dataset"] for m in decoded}) == 1
+        tiles.extend(m["tile"] for m in decoded)
+    assert sorted(tiles) == sorted(f"9-1-{i}" for i in range(24))
+
+
+@pytest.mark.parametrize("merge", [1, 2])
+def test_redrive_partial_failure(merge):
+    """Should only return the source messages that were fully sent."""
+    messages = []
+    for i in range(25):
+        source = _tile_message(i, f"9-1-{i}")
+        messages.append((source, create_jobs.decode(source["Body"])))
+
+    entries = (
+        create_jobs._merge_messages(messages, merge)
+        if merge > 1
+        else [(s["Body"], {s["MessageId"]: s}) for s, _ in messages]
+    )
+    failed_body, failed_sources = entries[-1]
+
+    sqs = SQS({"queue": []}, fail={failed_body})
+    sent = create_jobs.redrive_messages(sqs, "queue", messages, merge=merge)
+
+    assert all(len(b) <= 10 for b in sqs.batches)
+    assert len(sqs.sent) == len(entries) - 1
+    assert {m["MessageId"] for m in sent} == {
+        s["MessageId"] for s, _ in messages
+    } - set(failed_sources)
+
+
+def test_redrive_shared_source():
+    """Should keep a source message whose tiles were only partly sent."""
+    source = _sqs_message(
+        0, {"tiles": ["9-1-1", "9-1-2", "9-1-3"], "dataset": "s3://bucket/cog.tif"}
+    )
+    messages = [(source, create_jobs.decode(source["Body"]))]
+    entries = create_jobs._merge_messages(messages, 2)
+    assert len(entries) == 2
+
+    sqs = SQS({"queue": []}, fail={entries[1][0]})
+    assert create_jobs.redrive_messages(sqs, "queue", messages, merge=2) == []
+    assert len(sqs.sent) == 1
+
+
+def test_replay_failed_send_stays_in_dlq():
+    """Should not delete messages that could not be re-driven."""
+    dlq = [_tile_message(0, "9-1-1"), _tile_message(1, "9-1-2")]
+    sqs = SQS({"dlq": list(dlq), "queue": []}, fail={dlq[1]["Body"]})
+
+    classes, _ = create_jobs.replay_messages(sqs, "dlq", "queue", limit=2)
+    assert classes == {"retry": 2}
+    assert sqs.deleted == ["rh-0"]
+    assert "rh-1" in sqs.inflight
+
+
+def test_replay_skip_existing_tiles():
+    """Should only re-drive the tiles without output."""
+    tiles = [f"9-1-{i}" for i in range(10)]
+    dlq = [_sqs_message(0, {"tiles": tiles, "dataset": "s3://bucket/cog.tif"})]
+    sqs = SQS({"dlq": list(dlq), "queue": []})
+    s3 = S3({f"cog/{tile}.npz" for tile in tiles[:9]})
+
+    classes, retries = create_jobs.replay_messages(
+        sqs, "dlq", "queue", s3_client=s3, bucket="bucket"
+    )
+    assert classes == {"retry": 1}
+    assert retries == {("s3://bucket/cog.tif", 9): 1}
+    assert len(sqs.sent) == 1
+    assert [m["tile"] for m in create_jobs.decode(sqs.sent[0])] == ["9-1-9"]
+    assert sqs.deleted == ["rh-0"]
+
+
+@pytest.mark.parametrize("redeliver", [False, True])
+def test_replay_dry_run_repeats(redeliver):
+    """Should count each message once and stop, even when received again."""
+    dlq = [_tile_message(i, f"9-1-{i}") for i in range(25)]
+    sqs = SQS({"dlq": list(dlq), "queue": []}, redeliver=redeliver)
+
+    classes, _ = create_jobs.replay_messages(
+        sqs, "dlq", "queue", batch_size=10, dry_run=True
+    )
+    assert sum(classes.values()) <= 25
+    if not redeliver:
+        assert classes == {"retry": 25}
+    assert not sqs.inflight
+    assert len(sqs.queues["dlq"]) == 25
+
+
+def test_replay_invalid_repeats():
+    """Should not count messages left in the queue twice."""
+    dlq = [_sqs_message(i, "{not json") for i in range(5)]
+    sqs = SQS({"dlq": list(dlq), "queue": []})
+
+    # Invalid messages become visible again (expired visibility timeout)
+    receive = sqs.receive_message
+
+    def receive_message(QueueUrl, **kwargs):
+        response = receive(QueueUrl, **kwargs)
+        for m in response["Messages"]:
+            sqs.inflight.pop(m["ReceiptHandle"])
+            sqs.queues[QueueUrl].append(m)
+        return response
+
+    sqs.receive_message = receive_message
+
+    classes, _ = create_jobs.replay_messages(sqs, "dlq", "queue", batch_size=3)
+    assert classes == {"invalid-json": 5}
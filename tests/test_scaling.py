@@ -0,0 +1,93 @@
+"""test simulate_scaling."""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "scripts"))
+
+from simulate_scaling import backlog_seconds, simulate, target_tracking  # noqa: E402
+
+
+def test_backlog_seconds():
+    """Should include in-flight messages and never divide by zero."""
+    assert backlog_seconds(1000, 0, 10, 1.0) == 100
+    assert backlog_seconds(900, 100, 10, 1.0) == 100
+    assert backlog_seconds(0, 40, 0, 0.1) == 400
+    assert backlog_seconds(0, 0, 5, 2.0) == 0
+
+
+def test_target_tracking():
+    """Should propose capacity proportional to the metric."""
+    assert target_tracking(10, 600, 300) == 20
+    assert target_tracking(10, 150, 300) == 5
+    assert target_tracking(3, 301, 300) == 4
+
+
+def _actions(states):
+    return [(s["time"], s["action"]) for s in states if s["action"]]
+
+
+def test_wake_from_zero():
+    """Should start `scaling_steps` tasks as soon as messages are visible."""
+    states = list(simulate([{"visible": 0}, {"visible": 10}], scaling_steps=5))
+    assert states[0]["desired"] == 0
+    assert states[1]["desired"] == 5
+    assert states[1]["action"] == "wake"
+
+
+def test_scale_out_evaluation():
+    """Should only scale out after 3 datapoints above target."""
+    records = [{"visible": 100}] + [{"visible": 6000}] * 2 + [{"visible": 100}]
+    states = list(simulate(records, mincount=1, target_backlog=300))
+    assert not _actions(states)
+
+    records = [{"visible": 100}] + [{"visible": 6000}] * 3
+    states = list(simulate(records, mincount=1, target_backlog=300))
+    assert _actions(states) == [(180, "out")]
+    assert states[-1]["desired"] == 20
+
+
+def test_scale_in_evaluation():
+    """Should only scale in after 15 datapoints below 90% of the target."""
+    records = [{"visible": 0}] * 20
+    states = list(simulate(records, mincount=0, target_backlog=300))
+    assert _actions(states) == []
+
+    # Start with 10 tasks and a drained queue
+    states = simulate(
+        [{"visible": 2700, "tps": 1.0}] + [{"visible": 0}] * 20,
+        mincount=10,
+        target_backlog=300,
+    )
+    assert _actions(states) == []
+
+    records = [{"visible": 2000}] * 14 + [{"visible": 0}]
+    states = list(simulate(records, mincount=1, maxcount=10, target_backlog=300))
+    assert "in" not in dict(_actions(states)).values()
+
+
+def test_replay_queue():
+    """Should not scale in while the queue is being drained."""
+    records = [{"sent": 2000}] + [{"sent": 0}] * 30
+    states = list(simulate(records, maxcount=20, target_backlog=300))
+    actions = _actions(states)
+    assert actions[0] == (0, "wake")
+    assert [a for _, a in actions].count("in") == 1
+
+    # 15 datapoints below 90% of the target
+    scale_in = next(t for t, a in actions if a == "in")
+    high = max(s["time"] for s in states if s["metric"] >= 270)
+    assert scale_in == high + 15 * 60
+    assert states[-1]["desired"] == 0
+
+
+@pytest.mark.parametrize("batch_size", [1, 10])
+def test_inflight(batch_size):
+    """Should hold `batch_size` messages in flight per running task."""
+    records = [{"sent": 1000}] + [{"sent": 0}] * 3
+    states = list(simulate(records, batch_size=batch_size))
+    assert states[0]["inflight"] == 0
+    assert states[1]["inflight"] == 5 * batch_size
+    assert states[1]["visible"] + states[1]["inflight"] == 1000
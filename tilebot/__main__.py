@@ -1,15 +1,21 @@
 """tilebot main cmd."""
 
-import json
 import logging
 import os
+import signal
 import sys
+import threading
 import time
 
 import boto3
 from botocore.exceptions import ClientError
 
+from tilebot.heartbeat import Heartbeat, TileTimeoutError, shorten_timeout, timeout
+from tilebot.memory import memory_guard
+from tilebot.messages import parse
+from tilebot.metrics import Throughput, metrics
 from tilebot.process import process
+from tilebot.settings import metrics_config, worker_config
 
 logger = logging.getLogger("tilebot")
 logging.getLogger("botocore.credentials").disabled = True
@@ -17,13 +23,6 @@ logging.getLogger("botocore.utils").disabled = True
 logging.getLogger("rio-tiler").setLevel(logging.ERROR)
 
 
-def _parse_message(message):
-    if message.get("Records"):
-        record = message["Records"][0]
-        message = json.loads(record["body"])
-    return message["Message"]
-
-
 def main():
     """Pull Message and Process."""
     region_name = os.environ["REGION"]
@@ -38,20 +37,96 @@ def main():
         logger.warning(f"SQS Queue '{queue_name}' ({region_name}) not found")
         sys.exit(1)
 
-    while True:
-        message = False
-        for message in queue.receive_messages():
-            m = _parse_message(json.loads(message.body))
-            logger.debug(m)
-            process(m)
+    throughput = Throughput(
+        queue_name,
+        namespace=metrics_config.namespace,
+        client=boto3.client("cloudwatch", region_name=region_name),
+    )
+
+    heartbeat = Heartbeat(
+        boto3.client("sqs", region_name=region_name),
+        queue.url,
+        visibility_timeout=worker_config.visibility_timeout,
+        interval=worker_config.heartbeat_interval,
+    )
+    heartbeat.start()
+
+    # ECS sends SIGTERM on scale-in and Spot interruptions, then SIGKILL once
+    # the container stop timeout expires
+    stopping = threading.Event()
+
+    def _shutdown(signum, frame):
+        logger.warning("SIGTERM received, finishing in-flight tile...")
+        stopping.set()
+        shorten_timeout(worker_config.shutdown_grace)
+
+    signal.signal(signal.SIGTERM, _shutdown)
+
+    while not stopping.is_set():
+        messages = queue.receive_messages(
+            MaxNumberOfMessages=memory_guard.concurrency(worker_config.batch_size),
+            VisibilityTimeout=worker_config.visibility_timeout,
+        )
+        for message in messages:
+            heartbeat.add(message.message_id, message.receipt_handle)
+
+        for i, message in enumerate(messages):
+            if stopping.is_set():
+                # Hand the messages we won't process over to other tasks
+                heartbeat.release([m.message_id for m in messages[i:]])
+                break
+
+            t0 = time.time()
+            done = 0
+            try:
+                tiles = parse(message.body)
+                logger.debug(tiles)
+                for tile in tiles:
+                    if stopping.is_set():
+                        break
+                    with timeout(worker_config.tile_timeout):
+                        process(tile)
+                    done += 1
+            except TileTimeoutError as e:
+                # Let another task retry (or send it to the DeadLetter queue)
+                logger.warning(f"{e}, releasing message {message.message_id}")
+                heartbeat.release([message.message_id])
+                continue
+            except Exception as e:
+                logger.error(
+                    f"Could not process message {message.message_id}: {e!r}, "
+                    "releasing it"
+                )
+                heartbeat.release([message.message_id])
+                continue
+
+            if done < len(tiles):
+                # Stopped in the middle of a multi-tiles message
+                heartbeat.release([message.message_id])
+                continue
+
+            throughput.tick(time.time() - t0, n=len(tiles))
 
             # Let the queue know that the message is processed
+            heartbeat.remove(message.message_id)
             message.delete()
 
-        if not message:
+        if not messages:
+            metrics.flush()
+            throughput.publish()
             logger.warning("No message in Queue, will sleep for 60 seconds...")
-            time.sleep(60)  # if no message, let's wait 60secs
+            stopping.wait(60)  # if no message, let's wait 60secs
+
+    heartbeat.stop()
+    metrics.flush()
+    throughput.publish()
+    logger.warning("Worker stopped")
 
 
 if __name__ == "__main__":
-    main()
+    if sys.argv[1:2] == ["run"]:
+        from tilebot.runner import run
+
+        run(sys.argv[2:], prog_name="python -m tilebot run")
+    else:
+        main()
@@ -0,0 +1,191 @@
+"""tilebot.cache: share decoded source windows between tiles."""
+
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Any, Callable, Dict, Hashable, Iterator, Optional, Type
+
+from morecantile import Tile
+from rio_tiler.errors import TileOutsideBounds
+from rio_tiler.io import BaseReader
+from rio_tiler.models import ImageData
+
+from tilebot.memory import memory_guard
+from tilebot.settings import mosaic_config
+
+logger = logging.getLogger("tilebot")
+
+
+class WindowCache:
+    """Byte bounded LRU cache."""
+
+    def __init__(self, max_bytes: int = 0):
+        """Set cache size."""
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._items: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Get item and mark it as recently used."""
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+
+            self._items.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def put(self, key: Hashable, value: Any, nbytes: int):
+        """Add item, evicting the least recently used ones."""
+        if nbytes > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self._items:
+                self.nbytes -= self._items.pop(key)[1]
+
+            self._items[key] = (value, nbytes)
+            self.nbytes += nbytes
+            while self.nbytes > self.max_bytes:
+                _, (_, size) = self._items.popitem(last=False)
+                self.nbytes -= size
+
+    def clear(self):
+        """Empty the cache."""
+        with self._lock:
+            self._items.clear()
+            self.nbytes = 0
+
+
+window_cache = WindowCache(mosaic_config.window_cache_size)
+memory_guard.on_pressure(window_cache.clear)
+
+
+class DatasetCache:
+    """LRU cache of opened datasets, exited when evicted or cleared."""
+
+    def __init__(self, maxsize: int = 32):
+        """Set cache size."""
+        self.maxsize = maxsize
+        self._items: OrderedDict = OrderedDict()
+        # Datasets evicted while in use are exited once released
+        self._users: Dict[int, int] = {}
+        self._retired: Dict[int, Any] = {}
+        self._lock = threading.RLock()
+
+    @contextmanager
+    def open(self, key: Hashable, factory: Callable[[], Any]) -> Iterator:
+        """Yield the opened dataset for `key`, entering `factory()` if needed."""
+        with self._lock:
+            dataset = self._items.get(key)
+            if dataset is None:
+                dataset = factory().__enter__()
+                self._items[key] = dataset
+                while len(self._items) > self.maxsize:
+                    self._close(self._items.popitem(last=False)[1])
+            else:
+                self._items.move_to_end(key)
+            self._users[id(dataset)] = self._users.get(id(dataset), 0) + 1
+
+        try:
+            yield dataset
+        finally:
+            with self._lock:
+                self._users[id(dataset)] -= 1
+                if not self._users[id(dataset)]:
+                    del self._users[id(dataset)]
+                    if id(dataset) in self._retired:
+                        self._close(self._retired.pop(id(dataset)))
+
+    def _close(self, dataset: Any):
+        if id(dataset) in self._users:
+            self._retired[id(dataset)] = dataset
+            return
+
+        try:
+            dataset.__exit__(None, None, None)
+        except Exception as e:
+            logger.warning(f"Could not close dataset: {e}")
+
+    def clear(self):
+        """Exit and forget all the datasets."""
+        with self._lock:
+            while self._items:
+                self._close(self._items.popitem(last=False)[1])
+
+
+def _freeze(value: Any) -> Hashable:
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+@lru_cache(maxsize=None)
+def cached_reader(reader: Type[BaseReader], zoom_offset: int = 1) -> Type[BaseReader]:
+    """
+    Create a `reader` subclass cutting tiles from cached parent windows.
+
+    A tile at zoom Z is cut from the window of its parent at `Z - zoom_offset`
+    (read with a `tilesize * 2**zoom_offset` size, so with the same resolution
+    and overview level). Adjacent tiles in a job then decode each source block
+    once instead of once per tile.
+
+    """
+
+    class CachedReader(reader):  # type: ignore
+        def tile(
+            self,
+            tile_x: int,
+            tile_y: int,
+            tile_z: int,
+            tilesize: int = 256,
+            **kwargs: Any,
+        ) -> ImageData:
+            """Read a tile from its cached parent window."""
+            offset = min(zoom_offset, tile_z)
+            # Readers are short lived (one per asset and tile in a mosaic), ids
+            # are re-used: only cache windows of a stable source identifier.
+            src = getattr(self, "filepath", None) or getattr(self, "sceneid", None)
+            if (
+                not offset
+                or not src
+                or not window_cache.max_bytes
+                or kwargs.get("tile_buffer")
+            ):
+                return super().tile(tile_x, tile_y, tile_z, tilesize=tilesize, **kwargs)
+
+            if not self.tile_exists(tile_z, tile_x, tile_y):
+                raise TileOutsideBounds(
+                    f"Tile {tile_z}/{tile_x}/{tile_y} is outside image bounds"
+                )
+
+            px, py, pz = tile_x >> offset, tile_y >> offset, tile_z - offset
+            key = (reader, src, pz, px, py, tilesize, _freeze(kwargs))
+
+            window = window_cache.get(key)
+            if window is None:
+                window = super().tile(px, py, pz, tilesize=tilesize << offset, **kwargs)
+                window_cache.put(key, window, window.data.nbytes + window.mask.nbytes)
+
+            row = (tile_y - (py << offset)) * tilesize
+            col = (tile_x - (px << offset)) * tilesize
+            # Copies, mosaic pixel selection methods update tiles in place
+            return ImageData(
+                window.data[:, row : row + tilesize, col : col + tilesize].copy(),
+                window.mask[row : row + tilesize, col : col + tilesize].copy(),
+                assets=window.assets,
+                bounds=self.tms.xy_bounds(Tile(tile_x, tile_y, tile_z)),
+                crs=window.crs,
+            )
+
+    CachedReader.__name__ = f"Cached{reader.__name__}"
+    return CachedReader
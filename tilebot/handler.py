@@ -1,8 +1,9 @@
 """Worker."""
 
-import json
 import logging
 
+from tilebot.messages import parse
+from tilebot.metrics import metrics
 from tilebot.process import process
 
 logger = logging.getLogger("tilebot")
@@ -11,23 +12,21 @@ logging.getLogger("botocore.utils").disabled = True
 logging.getLogger("rio-tiler").setLevel(logging.ERROR)
 
 
-def _parse_message(message):
-    if not message.get("Records"):
-        return message
-
-    record = message["Records"][0]
-    body = json.loads(record["body"])
-    return body["Message"]
-
-
 def main(event, context):
     """
     Handle events.
 
     Events:
-        - SQS queue
+        - SQS queue (raw or SNS messages)
+        - SNS topic
+        - direct invocation
 
     """
-    message = _parse_message(event)
-    logger.info(message)
-    return process(message)
+    try:
+        for message in parse(event):
+            logger.info(message)
+            process(message)
+        return True
+    finally:
+        # Lambda may freeze the container once we return
+        metrics.flush()
@@ -0,0 +1,116 @@
+"""tilebot.heartbeat: keep in-flight SQS messages invisible."""
+
+import logging
+import signal
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterator, List
+
+from rio_tiler.utils import _chunks
+
+logger = logging.getLogger("tilebot")
+
+
+class TileTimeoutError(Exception):
+    """Tile processing took too long."""
+
+
+def _on_alarm(signum, frame):
+    raise TileTimeoutError("Tile processing timed out")
+
+
+@contextmanager
+def timeout(seconds: int) -> Iterator:
+    """Raise TileTimeoutError after `seconds` (main thread only, 0 to disable)."""
+    previous = signal.signal(signal.SIGALRM, _on_alarm)
+    if seconds:
+        signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+def shorten_timeout(seconds: int) -> bool:
+    """Make a running `timeout` expire in at most `seconds`."""
+    if signal.getsignal(signal.SIGALRM) is not _on_alarm:
+        return False
+
+    remaining, _ = signal.getitimer(signal.ITIMER_REAL)
+    if not remaining or remaining > seconds:
+        signal.setitimer(signal.ITIMER_REAL, seconds)
+    return True
+
+
+class Heartbeat(threading.Thread):
+    """Extend the visibility timeout of in-flight messages in the background."""
+
+    def __init__(
+        self, client, queue_url: str, visibility_timeout: int, interval: int,
+    ):
+        """Set queue and timings."""
+        super().__init__(daemon=True)
+        self.client = client
+        self.queue_url = queue_url
+        self.visibility_timeout = visibility_timeout
+        self.interval = interval
+        self._handles: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    def add(self, message_id: str, receipt_handle: str):
+        """Track an in-flight message."""
+        with self._lock:
+            self._handles[message_id] = receipt_handle
+
+    def remove(self, message_id: str):
+        """Stop tracking a message (processed or released)."""
+        with self._lock:
+            self._handles.pop(message_id, None)
+
+    def _change_visibility(self, handles: List[str], visibility_timeout: int):
+        for part in _chunks(handles, 10):
+            response = self.client.change_message_visibility_batch(
+                QueueUrl=self.queue_url,
+                Entries=[
+                    {
+                        "Id": str(i),
+                        "ReceiptHandle": handle,
+                        "VisibilityTimeout": visibility_timeout,
+                    }
+                    for i, handle in enumerate(part)
+                ],
+            )
+            for failed in response.get("Failed", []):
+                logger.warning(f"Could not change visibility: {failed}")
+
+    def beat(self):
+        """Extend the visibility of all tracked messages."""
+        # Hold the lock during the SQS call, so that a message released (or
+        # removed, then deleted) in the meantime is not made invisible again.
+        with self._lock:
+            handles = list(self._handles.values())
+            if handles:
+                self._change_visibility(handles, self.visibility_timeout)
+
+    def release(self, message_ids: List[str]):
+        """Make messages visible again right away."""
+        with self._lock:
+            handles = [
+                self._handles.pop(mid) for mid in message_ids if mid in self._handles
+            ]
+            if handles:
+                self._change_visibility(handles, 0)
+
+    def run(self):
+        """Beat every `interval` seconds."""
+        while not self._stopped.wait(self.interval):
+            try:
+                self.beat()
+            except Exception as e:
+                logger.warning(f"Heartbeat failed: {e}")
+
+    def stop(self):
+        """Stop the heartbeat."""
+        self._stopped.set()
@@ -0,0 +1,96 @@
+"""tilebot.memory: RSS guardrails."""
+
+import gc
+import logging
+import os
+import resource
+from typing import Callable, List, Optional
+
+from tilebot.settings import memory_config
+
+logger = logging.getLogger("tilebot")
+
+
+def rss() -> int:
+    """Current resident set size of the process, in bytes."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        # Peak RSS (KB on Linux), better than nothing
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def memory_limit() -> Optional[int]:
+    """Memory available to the container (cgroup or Lambda), in bytes."""
+    lambda_memory = os.environ.get("AWS_LAMBDA_FUNCTION_MEMORY_SIZE")
+    if lambda_memory:
+        return int(lambda_memory) * 1024 * 1024
+
+    for path in [
+        "/sys/fs/cgroup/memory.max",  # cgroup v2
+        "/sys/fs/cgroup/memory/memory.limit_in_bytes",  # cgroup v1
+    ]:
+        try:
+            with open(path) as f:
+                value = f.read().strip()
+        except OSError:
+            continue
+
+        # cgroup v1 reports a huge number when there is no limit
+        if value != "max" and int(value) < 1 << 60:
+            return int(value)
+
+    return None
+
+
+class MemoryGuard:
+    """Reduce concurrency when RSS gets close to the memory limit."""
+
+    def __init__(
+        self,
+        limit: Optional[int] = None,
+        high_watermark: float = 0.8,
+        low_watermark: float = 0.6,
+    ):
+        """Set limit and watermarks."""
+        self.limit = limit
+        self.high_watermark = high_watermark
+        self.low_watermark = low_watermark
+        self.factor = 1.0
+        self._callbacks: List[Callable] = []
+
+    def on_pressure(self, callback: Callable):
+        """Register a function releasing memory (e.g clearing a cache)."""
+        self._callbacks.append(callback)
+
+    def check(self) -> float:
+        """Update and return the concurrency factor (0 < factor <= 1)."""
+        if not self.limit:
+            return self.factor
+
+        used = rss() / self.limit
+        if used > self.high_watermark:
+            for callback in self._callbacks:
+                callback()
+            gc.collect()
+            self.factor = max(self.factor / 2, 0.01)
+            logger.warning(
+                f"RSS at {used:.0%} of memory limit, concurrency factor {self.factor}"
+            )
+
+        elif used < self.low_watermark and self.factor < 1:
+            self.factor = min(self.factor * 2, 1.0)
+
+        return self.factor
+
+    def concurrency(self, maximum: int) -> int:
+        """Allowed concurrency out of `maximum`."""
+        return max(int(maximum * self.check()), 1)
+
+
+memory_guard = MemoryGuard(
+    memory_config.limit or memory_limit(),
+    high_watermark=memory_config.high_watermark,
+    low_watermark=memory_config.low_watermark,
+)
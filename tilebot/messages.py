@@ -0,0 +1,146 @@
+"""tilebot.messages: decode SQS/SNS payloads into Messages."""
+
+import json
+from enum import Enum
+from functools import lru_cache
+from types import DynamicClassAttribute
+from typing import Any, Dict, List, Optional, Union
+
+from morecantile import Tile
+from pydantic import BaseModel, validator
+from rio_tiler.mosaic.methods import defaults
+
+try:
+    import orjson
+
+    loads = orjson.loads
+except ImportError:  # pragma: nocover
+    loads = json.loads
+
+
+class PixelSelectionMethod(str, Enum):
+    """rio-tiler-mosaic pixel selection methods"""
+
+    first = "first"
+    highest = "highest"
+    lowest = "lowest"
+    mean = "mean"
+    median = "median"
+    stdev = "stdev"
+
+    @DynamicClassAttribute
+    def method(self):
+        """Return rio-tiler-mosaic pixel selection class"""
+        return getattr(defaults, f"{self._value_.title()}Method")
+
+
+def parse_tile(tile: str) -> Tile:
+    """Parse `z-x-y` string."""
+    z, x, y = tile.split("-")
+    return Tile(int(x), int(y), int(z))
+
+
+class Message(BaseModel):
+    """Pydantic model for message."""
+
+    tile: Union[str, Tile]
+    dataset: str
+    indexes: Optional[str]  # 1,2,3 or asset1,asset2,asset3 or B1,B2,B3
+    expression: Optional[str]
+    pixel_selection: Optional[PixelSelectionMethod]
+    reader: str = "rio_tiler.io.COGReader"
+    job: Optional[str]
+
+    @validator("tile")
+    def validate_and_parse(cls, v) -> Tile:
+        """Parse and return Morecantile Tile."""
+        if isinstance(v, Tile):
+            return v
+        return parse_tile(v)
+
+    class Config:
+        """Config for model."""
+
+        extra = "ignore"
+
+
+# Message fields shared by all the tiles of a job
+TEMPLATE_FIELDS = (
+    "dataset",
+    "indexes",
+    "expression",
+    "pixel_selection",
+    "reader",
+    "job",
+)
+
+
+@lru_cache(maxsize=128)
+def _template(*values) -> Message:
+    options = {k: v for k, v in zip(TEMPLATE_FIELDS, values) if v is not None}
+    return Message(tile="0-0-0", **options)
+
+
+def parse_message(message: Dict[str, Any]) -> Message:
+    """Create a Message, validating the job options only once."""
+    if not isinstance(message, dict):
+        raise TypeError("Message should be a JSON object")
+
+    values = tuple(message.get(k) for k in TEMPLATE_FIELDS)
+    tile = message.get("tile")
+    if not isinstance(tile, str) or not all(
+        v is None or isinstance(v, str) for v in values
+    ):
+        return Message(**message)
+
+    try:
+        tile = parse_tile(tile)
+    except ValueError:
+        return Message(**message)  # let pydantic raise a ValidationError
+
+    return _template(*values).copy(update={"tile": tile})
+
+
+def _unwrap(message: Any) -> Any:
+    """Remove SNS envelope."""
+    if isinstance(message, dict) and "Message" in message:
+        message = message["Message"]
+        if isinstance(message, (str, bytes)):
+            message = loads(message)
+    return message
+
+
+def decode(payload: Union[str, bytes, Dict]) -> List[Any]:
+    """
+    Decode a payload into a list of message dicts.
+
+    Supports:
+        - raw message: `{"tile": ..., "dataset": ...}`
+        - SNS envelope: `{"Type": "Notification", "Message": "{...}"}`
+        - SQS/SNS batch event: `{"Records": [{"body": ...}, {"Sns": {...}}]}`
+        - merged message: `{"tiles": ["z-x-y", ...], "dataset": ...}`
+
+    """
+    if isinstance(payload, (str, bytes)):
+        payload = loads(payload)
+
+    if isinstance(payload, dict) and payload.get("Records"):
+        messages = []
+        for record in payload["Records"]:
+            if "body" in record:
+                messages.extend(decode(record["body"]))
+            else:
+                messages.extend(decode(record["Sns"]))
+        return messages
+
+    message = _unwrap(payload)
+    if isinstance(message, dict) and message.get("tiles"):
+        options = {k: v for k, v in message.items() if k != "tiles"}
+        return [{**options, "tile": tile} for tile in message["tiles"]]
+
+    return [message]
+
+
+def parse(payload: Union[str, bytes, Dict]) -> List[Message]:
+    """Decode and validate a payload."""
+    return [parse_message(message) for message in decode(payload)]
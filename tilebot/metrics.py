@@ -0,0 +1,327 @@
+"""tilebot.metrics: per-job counters."""
+
+import json
+import logging
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from boto3.session import Session as boto3_session
+
+from tilebot.settings import metrics_config
+
+logger = logging.getLogger("tilebot")
+
+STATUSES = ("done", "empty", "no-asset", "failed")
+
+Counters = Dict[Tuple[str, int, str], List[int]]
+
+
+class EMFSink:
+    """Write counters as CloudWatch Embedded Metric Format log lines."""
+
+    def __init__(self, namespace: str = "tilebot"):
+        """Set Namespace."""
+        self.namespace = namespace
+
+    def write(self, counters: Counters, start: float, end: float):
+        """Print one EMF document per job and zoom level."""
+        docs: Dict[Tuple[str, int], Dict[str, Any]] = {}
+        for (job, zoom, status), (count, nbytes) in counters.items():
+            doc = docs.setdefault(
+                (job, zoom), {"Job": job, "Zoom": str(zoom), "BytesWritten": 0}
+            )
+            doc[status] = doc.get(status, 0) + count
+            doc["BytesWritten"] += nbytes
+
+        for doc in docs.values():
+            doc["_aws"] = {
+                "Timestamp": int(end * 1000),
+                "CloudWatchMetrics": [
+                    {
+                        "Namespace": self.namespace,
+                        "Dimensions": [["Job", "Zoom"]],
+                        "Metrics": [
+                            {"Name": name, "Unit": "Count"}
+                            for name in STATUSES
+                            if name in doc
+                        ]
+                        + [{"Name": "BytesWritten", "Unit": "Bytes"}],
+                    }
+                ],
+            }
+            print(json.dumps(doc), flush=True)
+
+
+class SQLiteSink:
+    """Aggregate counters in a local SQLite database (offline runs)."""
+
+    def __init__(self, path: str):
+        """Create tables."""
+        self.path = path
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS counters ("
+                "job TEXT, zoom INTEGER, status TEXT, count INTEGER, bytes INTEGER, "
+                "first REAL, last REAL, PRIMARY KEY (job, zoom, status))"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "job TEXT, zoom INTEGER, total INTEGER, created REAL, "
+                "PRIMARY KEY (job, zoom))"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=30)
+
+    def write(self, counters: Counters, start: float, end: float):
+        """Add counters to the aggregated rows."""
+        with self._connect() as conn:
+            for (job, zoom, status), (count, nbytes) in counters.items():
+                conn.execute(
+                    "INSERT OR IGNORE INTO counters VALUES (?, ?, ?, 0, 0, ?, ?)",
+                    (job, zoom, status, start, end),
+                )
+                conn.execute(
+                    "UPDATE counters SET count = count + ?, bytes = bytes + ?, "
+                    "first = min(first, ?), last = max(last, ?) "
+                    "WHERE job = ? AND zoom = ? AND status = ?",
+                    (count, nbytes, start, end, job, zoom, status),
+                )
+
+    def write_job(self, job: str, totals: Dict[int, int]):
+        """Register the number of tiles sent for a job, per zoom level."""
+        now = time.time()
+        with self._connect() as conn:
+            for zoom, total in totals.items():
+                conn.execute(
+                    "INSERT OR IGNORE INTO jobs VALUES (?, ?, 0, ?)", (job, zoom, now)
+                )
+                conn.execute(
+                    "UPDATE jobs SET total = total + ? WHERE job = ? AND zoom = ?",
+                    (total, job, zoom),
+                )
+
+    def read(self, job: str) -> Dict[str, Any]:
+        """Return job totals and counters."""
+        with self._connect() as conn:
+            totals = dict(
+                conn.execute("SELECT zoom, total FROM jobs WHERE job = ?", (job,))
+            )
+            rows = conn.execute(
+                "SELECT zoom, status, count, bytes, first, last FROM counters "
+                "WHERE job = ?",
+                (job,),
+            ).fetchall()
+
+        counters: Dict[int, Dict[str, int]] = {}
+        first, last = None, None
+        for zoom, status, count, nbytes, start, end in rows:
+            zc = counters.setdefault(zoom, {"bytes": 0})
+            zc[status] = count
+            zc["bytes"] += nbytes
+            first = start if first is None else min(first, start)
+            last = end if last is None else max(last, end)
+
+        return {"totals": totals, "counters": counters, "first": first, "last": last}
+
+
+def read_cloudwatch(
+    job: str,
+    namespace: str = "tilebot",
+    since: float = 14 * 86400,
+    period: int = 300,
+    client=None,
+) -> Dict[str, Any]:
+    """Return job counters from the EMF metrics (see `SQLiteSink.read`)."""
+    if client is None:
+        session = boto3_session()
+        client = session.client("cloudwatch")
+
+    zooms = set()
+    paginator = client.get_paginator("list_metrics")
+    for page in paginator.paginate(
+        Namespace=namespace, Dimensions=[{"Name": "Job", "Value": job}]
+    ):
+        for metric in page["Metrics"]:
+            for dim in metric["Dimensions"]:
+                if dim["Name"] == "Zoom":
+                    zooms.add(dim["Value"])
+
+    names = STATUSES + ("BytesWritten",)
+    queries = {}
+    for i, zoom in enumerate(sorted(zooms, key=int)):
+        for j, name in enumerate(names):
+            queries[f"m{i}_{j}"] = (int(zoom), name)
+
+    end = time.time()
+    start = end - since
+    counters: Dict[int, Dict[str, int]] = {}
+    first, last = None, None
+
+    ids = list(queries)
+    paginator = client.get_paginator("get_metric_data")
+    # GetMetricData accepts at most 500 queries per call
+    for n in range(0, len(ids), 500):
+        mdq = []
+        for qid in ids[n : n + 500]:
+            zoom, name = queries[qid]
+            mdq.append(
+                {
+                    "Id": qid,
+                    "MetricStat": {
+                        "Metric": {
+                            "Namespace": namespace,
+                            "MetricName": name,
+                            "Dimensions": [
+                                {"Name": "Job", "Value": job},
+                                {"Name": "Zoom", "Value": str(zoom)},
+                            ],
+                        },
+                        "Period": period,
+                        "Stat": "Sum",
+                    },
+                }
+            )
+
+        for page in paginator.paginate(
+            MetricDataQueries=mdq, StartTime=int(start), EndTime=int(end)
+        ):
+            for result in page["MetricDataResults"]:
+                zoom, name = queries[result["Id"]]
+                zc = counters.setdefault(zoom, {"bytes": 0})
+                key = "bytes" if name == "BytesWritten" else name
+                zc[key] = zc.get(key, 0) + int(sum(result["Values"]))
+
+                for ts, value in zip(result["Timestamps"], result["Values"]):
+                    if not value:
+                        continue
+                    ts = ts.timestamp()
+                    first = ts if first is None else min(first, ts)
+                    last = ts + period if last is None else max(last, ts + period)
+
+    return {"totals": {}, "counters": counters, "first": first, "last": last}
+
+
+def get_sink(uri: Optional[str], namespace: str = "tilebot"):
+    """Create a sink from `emf` or `sqlite:///path` uri."""
+    if not uri:
+        return None
+
+    if uri == "emf":
+        return EMFSink(namespace)
+
+    if uri.startswith("sqlite://"):
+        return SQLiteSink(uri.replace("sqlite://", "", 1))
+
+    raise ValueError(f"Invalid metrics sink: {uri}")
+
+
+class JobMetrics:
+    """Batch per-job counters and flush them to a sink."""
+
+    def __init__(
+        self, sink=None, flush_size: int = 100, flush_interval: float = 60.0,
+    ):
+        """Set sink and flush policy."""
+        self.sink = sink
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self._counters: Counters = {}
+        self._pending = 0
+        self._start = time.time()
+        self._lock = threading.Lock()
+
+    def record(self, job: Optional[str], zoom: int, status: str, nbytes: int = 0):
+        """Count one tile output."""
+        if self.sink is None:
+            return
+
+        with self._lock:
+            key = (job or "default", zoom, status)
+            counter = self._counters.setdefault(key, [0, 0])
+            counter[0] += 1
+            counter[1] += nbytes
+            self._pending += 1
+            full = self._pending >= self.flush_size
+            late = time.time() - self._start >= self.flush_interval
+
+        if full or late:
+            self.flush()
+
+    def flush(self):
+        """Send pending counters to the sink."""
+        with self._lock:
+            counters, self._counters = self._counters, {}
+            start, self._start = self._start, time.time()
+            self._pending = 0
+
+        if counters and self.sink is not None:
+            try:
+                self.sink.write(counters, start, time.time())
+            except Exception as e:  # metrics should never stop the worker
+                logger.warning(f"Could not write metrics: {e}")
+
+
+metrics = JobMetrics(
+    get_sink(metrics_config.sink, metrics_config.namespace),
+    flush_size=metrics_config.flush_size,
+    flush_interval=metrics_config.flush_interval,
+)
+
+
+class Throughput:
+    """Publish the tiles per second processed by this task to CloudWatch."""
+
+    def __init__(
+        self,
+        queue_name: str,
+        namespace: str = "tilebot",
+        interval: float = 60.0,
+        client=None,
+    ):
+        """Set Metric dimension and publishing interval."""
+        self.queue_name = queue_name
+        self.namespace = namespace
+        self.interval = interval
+        self.client = client
+        self._count = 0
+        self._busy = 0.0
+        self._start = time.time()
+
+    def tick(self, duration: float, n: int = 1):
+        """Count processed tiles and the time spent on them."""
+        self._count += n
+        self._busy += duration
+        if time.time() - self._start >= self.interval:
+            self.publish()
+
+    def publish(self):
+        """Send TilesPerSecondPerTask metric."""
+        count, busy = self._count, self._busy
+        self._count, self._busy, self._start = 0, 0.0, time.time()
+
+        # We only publish when busy, an idle task doesn't tell us anything
+        # about how fast tiles are processed.
+        if not count or not busy:
+            return
+
+        if self.client is None:
+            session = boto3_session()
+            self.client = session.client("cloudwatch")
+
+        try:
+            self.client.put_metric_data(
+                Namespace=self.namespace,
+                MetricData=[
+                    {
+                        "MetricName": "TilesPerSecondPerTask",
+                        "Dimensions": [{"Name": "QueueName", "Value": self.queue_name}],
+                        "Value": count / busy,
+                        "Unit": "Count/Second",
+                    }
+                ],
+            )
+        except Exception as e:
+            logger.warning(f"Could not publish throughput: {e}")
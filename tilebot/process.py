@@ -1,14 +1,15 @@
 """Process."""
 
 import importlib
-import json
 import logging
 import os
+import shutil
+import tempfile
 import warnings
-from enum import Enum
+from contextlib import contextmanager
+from functools import partial
 from io import BytesIO
-from types import DynamicClassAttribute
-from typing import Any, BinaryIO, Dict, Optional, Union
+from typing import Any, BinaryIO, Callable, Dict, Iterator, List, Optional, Tuple, Type
 from urllib.parse import urlparse
 
 import numpy
@@ -16,43 +17,106 @@ from boto3.session import Session as boto3_session
 from cogeo_mosaic.backends import MosaicBackend
 from cogeo_mosaic.errors import NoAssetFoundError
 from morecantile import Tile
-from pydantic import BaseModel, validator
 from rio_tiler.constants import MAX_THREADS
 from rio_tiler.errors import EmptyMosaicError, TileOutsideBounds
 from rio_tiler.io import BaseReader
-from rio_tiler.mosaic.methods import defaults
 
-from tilebot.settings import mosaic_config
+from tilebot.cache import DatasetCache, cached_reader
+from tilebot.memory import memory_guard
+from tilebot.messages import Message, parse
+from tilebot.metrics import metrics
+from tilebot.settings import memory_config, mosaic_config
 
 logger = logging.getLogger("tilebot")
 
 
-class PixelSelectionMethod(str, Enum):
-    """rio-tiler-mosaic pixel selection methods"""
+def _s3_upload(
+    file_obj: BinaryIO, bucket: str, key: str, client: boto3_session.client = None
+) -> bool:
+    if not client:
+        session = boto3_session()
+        client = session.client("s3")
+    client.upload_fileobj(file_obj, bucket, key)
+    return True
 
-    first = "first"
-    highest = "highest"
-    lowest = "lowest"
-    mean = "mean"
-    median = "median"
-    stdev = "stdev"
 
-    @DynamicClassAttribute
-    def method(self):
-        """Return rio-tiler-mosaic pixel selection class"""
-        return getattr(defaults, f"{self._value_.title()}Method")
+def _upload(file_obj: BinaryIO, bucket: str, key: str) -> bool:
+    """Write to S3 or, for `file:///path` outputs, to a local directory."""
+    if bucket.startswith("file://"):
+        path = os.path.join(bucket.replace("file://", "", 1), key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            shutil.copyfileobj(file_obj, f)
+        return True
 
+    return _s3_upload(file_obj, bucket, key)
 
-def _s3_upload(
-    file_obj: BinaryIO, bucket: str, key: str, client: boto3_session.client = None
+
+def _s3_upload_file(
+    path: str, bucket: str, key: str, client: boto3_session.client = None
 ) -> bool:
     if not client:
         session = boto3_session()
         client = session.client("s3")
-    client.upload_fileobj(file_obj, bucket, key)
+    # Unlike upload_fileobj, upload_file reads the file in chunks
+    client.upload_file(path, bucket, key)
     return True
 
 
+def _spool_upload(write: Callable[[BinaryIO], None], bucket: str, key: str) -> int:
+    """Upload what `write` writes through a temporary file, return its size."""
+    path = None
+    if bucket.startswith("file://"):
+        path = os.path.join(bucket.replace("file://", "", 1), key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Renamed once complete, don't leave a truncated file if `write` fails
+        tmp = f"{path}.{os.getpid()}.tmp"
+    else:
+        fd, tmp = tempfile.mkstemp(suffix=".npz")
+        os.close(fd)
+
+    try:
+        with open(tmp, "wb") as f:
+            write(f)
+            nbytes = f.tell()
+
+        if path:
+            os.replace(tmp, path)
+        else:
+            _s3_upload_file(tmp, bucket, key)
+
+    finally:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+
+    return nbytes
+
+
+# Mosaics and readers kept opened between tiles
+_warm_datasets = DatasetCache(maxsize=32)
+memory_guard.on_pressure(_warm_datasets.clear)
+
+
+@contextmanager
+def _open_dataset(url: str, reader: Type[BaseReader], mosaic: bool) -> Iterator:
+    """Open a Mosaic or a Reader, re-using opened ones if `MOSAIC_CACHE=TRUE`."""
+    if mosaic_config.cache:
+        if mosaic:
+            factory = partial(MosaicBackend, url, reader=reader)
+        else:
+            factory = partial(reader, url)
+        with _warm_datasets.open((url, reader, mosaic), factory) as src_dst:
+            yield src_dst
+
+    elif mosaic:
+        with MosaicBackend(url, reader=reader) as src_dst:
+            yield src_dst
+
+    else:
+        with reader(url) as src_dst:
+            yield src_dst
+
+
 def _get_options(self, src_dst, indexes: Optional[str] = None):
     """Create Reader options."""
     kwargs: Dict[str, Any] = {}
@@ -76,36 +140,115 @@ def _get_options(self, src_dst, indexes: Optional[str] = None):
     return kwargs
 
 
-class Message(BaseModel):
-    """Pydantic model for message."""
-
-    tile: Union[str, Tile]
-    dataset: str
-    indexes: Optional[str]  # 1,2,3 or asset1,asset2,asset3 or B1,B2,B3
-    expression: Optional[str]
-    pixel_selection: Optional[PixelSelectionMethod]
-    reader: str = "rio_tiler.io.COGReader"
-
-    @validator("tile")
-    def validate_and_parse(cls, v) -> Tile:
-        """Parse and return Morecantile Tile."""
-        z, x, y = list(map(int, v.split("-")))
-        return Tile(x, y, z)
+def _parse_dataset(dataset: str) -> Tuple[Optional[str], str]:
+    """Return mosaic url (None for simple datasets) and output prefix."""
+    # MosaicReader
+    # mosaic+mosaicid://
+    # mosaic+https://
+    # mosaic+s3://
+    parsed = urlparse(dataset)
+    if parsed.scheme and (
+        parsed.scheme.startswith("mosaic+") or parsed.scheme == "mosaicid"
+    ):
+        mosaic_dataset = dataset.replace("mosaic+", "")
+
+        if mosaic_dataset.startswith("mosaicid://"):  # dataset is a mosaic id
+            bname = mosaic_dataset.replace("mosaicid://", "")
+            if mosaic_config.backend == "dynamodb://":
+                url = f"{mosaic_config.backend}{mosaic_config.host}:{bname}"
+            else:
+                url = f"{mosaic_config.backend}{mosaic_config.host}/{bname}{mosaic_config.format}"
+
+        else:  # dataset is a full mosaic path
+            url = mosaic_dataset
+            bname = os.path.basename(mosaic_dataset).split(".")[0]
+
+        return url, bname
+
+    # BaseReader
+    return None, os.path.basename(dataset).split(".")[0]
+
+
+def _output_key(bname: str, tile: Tile) -> str:
+    """Output NPZ key."""
+    return os.path.join(bname, f"{tile.z}-{tile.x}-{tile.y}.npz")
+
+
+def output_keys(message: Message) -> List[str]:
+    """List the output keys of a message (one per dataset)."""
+    return [
+        _output_key(_parse_dataset(dataset)[1], message.tile)
+        for dataset in message.dataset.split(",")
+    ]
+
+
+def _process_dataset(
+    message: Message, dataset: str, reader: Type[BaseReader], kwargs: Dict, bucket: str,
+) -> Tuple[str, int]:
+    """Create NPY tile for one dataset and return its status and size."""
+    tile = message.tile
+    url, bname = _parse_dataset(dataset)
+    out_key = _output_key(bname, tile)
+
+    if url:
+        if mosaic_config.window_cache_size:
+            reader = cached_reader(reader, mosaic_config.window_zoom_offset)
+
+        with _open_dataset(url, reader, mosaic=True) as src_dst:
+            if not message.expression:
+                # For Mosaic we cannot guess the assets or bands
+                # User will have to pass indexes=B1,B2,B3 or indexes=asset1,asset2
+                bidx_kwargs = _get_options(src_dst, message.indexes)
+                kwargs = {**kwargs, **bidx_kwargs}
+
+            threads = int(os.getenv("MOSAIC_CONCURRENCY", MAX_THREADS))
+            threads = memory_guard.concurrency(threads)
+            try:
+                data, _ = src_dst.tile(*tile, threads=threads, **kwargs)
+            except NoAssetFoundError:
+                logger.warning(f"No asset of {dataset} - {tile.z}-{tile.x}-{tile.y}")
+                return "no-asset", 0
+            except EmptyMosaicError:
+                logger.warning(f"No data of {dataset} - {tile.z}-{tile.x}-{tile.y}")
+                return "empty", 0
+
+    # BaseReader
+    else:
+        with _open_dataset(dataset, reader, mosaic=False) as src_dst:
+            if not message.expression:
+                bidx_kwargs = _get_options(src_dst, message.indexes)
+                kwargs = {**kwargs, **bidx_kwargs}
+            try:
+                data = src_dst.tile(*tile, **kwargs)
+            except TileOutsideBounds:
+                return "empty", 0
+
+    if memory_config.stream_output:
+        nbytes = _spool_upload(
+            lambda f: numpy.savez_compressed(f, data=data.data, mask=data.mask),
+            bucket,
+            out_key,
+        )
 
-    class Config:
-        """Config for model."""
+    else:
+        bio = BytesIO()
+        numpy.savez_compressed(bio, data=data.data, mask=data.mask)
+        nbytes = bio.tell()
+        bio.seek(0)
+        _upload(bio, bucket, out_key)
 
-        extra = "ignore"
+    return "done", nbytes
 
 
 def process(message):
     """Create NPY tile."""
     out_bucket = os.environ["OUTPUT_BUCKET"]
 
-    # Parse SNS message
-    if isinstance(message, str):
-        message = json.loads(message)
-    message = Message(**message)
+    # Raw, SNS or merged (multiple tiles) message
+    if not isinstance(message, Message):
+        for m in parse(message):
+            process(m)
+        return True
 
     # Import Reader Class
     module, classname = message.reader.rsplit(".", 1)
@@ -121,64 +264,14 @@ def process(message):
 
     # We allow multiple datasets in form of `dataset1,dataset2,dataset3`
     for dataset in message.dataset.split(","):
-        # MosaicReader
-        # mosaic+mosaicid://
-        # mosaic+https://
-        # mosaic+s3://
-        parsed = urlparse(dataset)
-        if parsed.scheme and (
-            parsed.scheme.startswith("mosaic+") or parsed.scheme == "mosaicid"
-        ):
-            mosaic_dataset = dataset.replace("mosaic+", "")
-
-            if mosaic_dataset.startswith("mosaicid://"):  # dataset is a mosaic id
-                bname = mosaic_dataset.replace("mosaicid://", "")
-                if mosaic_config.backend == "dynamodb://":
-                    url = f"{mosaic_config.backend}{mosaic_config.host}:{bname}"
-                else:
-                    url = f"{mosaic_config.backend}{mosaic_config.host}/{bname}{mosaic_config.format}"
-
-            else:  # dataset is a full mosaic path
-                url = mosaic_dataset
-                bname = os.path.basename(mosaic_dataset).split(".")[0]
-
-            out_key = os.path.join(
-                bname, f"{message.tile.z}-{message.tile.x}-{message.tile.y}.npz"
+        try:
+            status, nbytes = _process_dataset(
+                message, dataset, reader, kwargs, out_bucket
             )
-            with MosaicBackend(url, reader=reader) as src_dst:
-                if not message.expression:
-                    # For Mosaic we cannot guess the assets or bands
-                    # User will have to pass indexes=B1,B2,B3 or indexes=asset1,asset2
-                    bidx_kwargs = _get_options(src_dst, message.indexes)
-                    kwargs = {**kwargs, **bidx_kwargs}
-
-                threads = int(os.getenv("MOSAIC_CONCURRENCY", MAX_THREADS))
-                try:
-                    data, _ = src_dst.tile(*message.tile, threads=threads, **kwargs)
-                except (NoAssetFoundError, EmptyMosaicError):
-                    logger.warning(
-                        f"No data of {mosaic_dataset} - {message.tile.z}-{message.tile.x}-{message.tile.y}"
-                    )
-                    continue
-
-        # BaseReader
-        else:
-            bname = os.path.basename(dataset).split(".")[0]
-            out_key = os.path.join(
-                bname, f"{message.tile.z}-{message.tile.x}-{message.tile.y}.npz"
-            )
-            with reader(dataset) as src_dst:
-                if not message.expression:
-                    bidx_kwargs = _get_options(src_dst, message.indexes)
-                    kwargs = {**kwargs, **bidx_kwargs}
-                try:
-                    data = src_dst.tile(*message.tile, **kwargs)
-                except TileOutsideBounds:
-                    continue
+        except Exception:
+            metrics.record(message.job, message.tile.z, "failed")
+            raise
 
-        bio = BytesIO()
-        numpy.savez_compressed(bio, data=data.data, mask=data.mask)
-        bio.seek(0)
-        _s3_upload(bio, out_bucket, out_key)
+        metrics.record(message.job, message.tile.z, status, nbytes)
 
     return True
@@ -0,0 +1,168 @@
+"""tilebot.runner: process tiles on a single host, without SNS/SQS."""
+
+import logging
+import multiprocessing
+import os
+import sys
+import time
+from multiprocessing.util import Finalize
+from typing import Dict, Iterator, Optional, Tuple
+
+import click
+import morecantile
+
+from tilebot.metrics import metrics
+from tilebot.process import process
+from tilebot.settings import mosaic_config
+
+logger = logging.getLogger("tilebot")
+
+_options: Dict = {}
+
+
+def _init_worker(options: Dict):
+    """Set message options and keep datasets opened in each process."""
+    global _options
+    _options = options
+    mosaic_config.cache = True
+    Finalize(None, metrics.flush, exitpriority=10)
+
+
+def _run_tile(tile: str) -> Tuple[str, Optional[str]]:
+    """Process one tile and return the error, if any."""
+    try:
+        process({**_options, "tile": tile})
+    except Exception as e:
+        logger.error(f"{tile}: {e!r}")
+        return tile, repr(e)
+    return tile, None
+
+
+def _bbox_tiles(bbox: str, zooms) -> Iterator[str]:
+    w, s, e, n = map(float, bbox.split(","))
+    tms = morecantile.tms.get("WebMercatorQuad")
+    for t in tms.tiles(w, s, e, n, list(zooms)):
+        yield f"{t.z}-{t.x}-{t.y}"
+
+
+@click.command()
+@click.argument("tiles", default="-", type=click.File("r"), required=False)
+@click.option("--bbox", type=str, help="west,south,east,north (instead of TILES)")
+@click.option("--zoom", type=int, multiple=True, help="Zoom level(s) for --bbox")
+@click.option("--dataset", type=str, required=True)
+@click.option("--reader", type=str)
+@click.option("--layers", type=str)
+@click.option("--expression", type=str)
+@click.option("--pixel-selection", type=str)
+@click.option("--job", type=str)
+@click.option(
+    "--output",
+    type=str,
+    envvar="OUTPUT_BUCKET",
+    required=True,
+    help="Output bucket or local directory (file:///path).",
+)
+@click.option(
+    "--checkpoint",
+    type=click.Path(dir_okay=False),
+    help="File listing processed tiles, used to resume a run.",
+)
+@click.option(
+    "--processes", type=int, default=os.cpu_count(), show_default=True,
+)
+def run(
+    tiles,
+    bbox,
+    zoom,
+    dataset,
+    reader,
+    layers,
+    expression,
+    pixel_selection,
+    job,
+    output,
+    checkpoint,
+    processes,
+):
+    """
+    Create tiles locally.
+
+    Example:
+    cat list_z14.txt | python -m tilebot run - \\
+        --dataset mosaicid://mydataset \\
+        --output file:///data/tiles \\
+        --checkpoint z14.done
+
+    python -m tilebot run --bbox 102.0,20.0,103.0,21.0 --zoom 12 --zoom 13 ...
+
+    """
+    if bbox:
+        if not zoom:
+            raise click.UsageError("--bbox requires --zoom")
+        todo = list(_bbox_tiles(bbox, zoom))
+    else:
+        todo = [line.strip() for line in tiles if line.strip()]
+
+    done = set()
+    if checkpoint and os.path.exists(checkpoint):
+        with open(checkpoint) as f:
+            done = {line.strip() for line in f}
+        todo = [tile for tile in todo if tile not in done]
+        click.echo(f"Resuming: {len(done)} tiles already processed", err=True)
+
+    options = {"dataset": dataset, "job": job}
+    if layers:
+        options["indexes"] = layers
+    if expression:
+        options["expression"] = expression
+    if reader:
+        options["reader"] = reader
+    if pixel_selection:
+        options["pixel_selection"] = pixel_selection
+
+    # Inherited by the worker processes
+    os.environ["OUTPUT_BUCKET"] = output
+
+    total = len(todo)
+    count = failed = 0
+    start = last = time.time()
+
+    ckpt = open(checkpoint, "a") if checkpoint else None
+    pool = multiprocessing.Pool(processes, _init_worker, (options,))
+    try:
+        for tile, error in pool.imap_unordered(_run_tile, todo, chunksize=8):
+            count += 1
+            if error:
+                failed += 1
+            elif ckpt:
+                ckpt.write(f"{tile}\n")
+
+            now = time.time()
+            if now - last >= 1 or count == total:
+                last = now
+                if ckpt:
+                    ckpt.flush()
+                rate = count / (now - start)
+                eta = (total - count) / rate if rate else 0
+                sys.stderr.write(
+                    f"\r{count}/{total} tiles | {failed} failed | "
+                    f"{rate:.1f} tiles/s | ETA {eta:.0f}s "
+                )
+                sys.stderr.flush()
+
+    except BaseException:
+        pool.terminate()
+        raise
+
+    else:
+        pool.close()
+
+    finally:
+        pool.join()
+        if ckpt:
+            ckpt.close()
+
+    sys.stderr.write("\n")
+    if failed:
+        click.echo(f"{failed} tiles failed, run again to retry them", err=True)
+        sys.exit(1)
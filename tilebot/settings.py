@@ -11,6 +11,13 @@ class MosaicSettings(pydantic.BaseSettings):
     backend: Optional[str]
     host: Optional[str]
     format: Optional[str] = ".json"
+    # Keep mosaics (the MosaicBackend, not its assets) and readers opened between
+    # tiles
+    cache: bool = False
+    # Size (bytes) of the in-process cache of decoded source windows (0 to disable)
+    window_cache_size: int = 0
+    # Windows are read at `zoom - offset` and shared by up to 4**offset tiles
+    window_zoom_offset: int = 1
 
     class Config:
         """model config"""
@@ -19,3 +26,69 @@ class MosaicSettings(pydantic.BaseSettings):
 
 
 mosaic_config = MosaicSettings()
+
+
+class MetricsSettings(pydantic.BaseSettings):
+    """Job metrics settings"""
+
+    # `emf` or `sqlite:///path/to/metrics.db`
+    sink: Optional[str]
+    namespace: str = "tilebot"
+    flush_size: int = 100
+    flush_interval: float = 60.0
+
+    class Config:
+        """model config"""
+
+        env_prefix = "METRICS_"
+
+
+metrics_config = MetricsSettings()
+
+
+class WorkerSettings(pydantic.BaseSettings):
+    """ECS worker settings"""
+
+    # Must match the SQS queue visibility timeout
+    visibility_timeout: int = 120
+    heartbeat_interval: int = 30
+    # Release the message when a tile takes longer (0 to disable)
+    tile_timeout: int = 900
+    # Time left to the in-flight tile after SIGTERM before it is released
+    shutdown_grace: int = 20
+    batch_size: int = 1
+
+    class Config:
+        """model config"""
+
+        env_prefix = "WORKER_"
+
+    @pydantic.validator("batch_size")
+    def validate_batch_size(cls, v) -> int:
+        """Validate SQS batch size."""
+        if not 1 <= v <= 10:
+            raise ValueError("Batch size must be between 1 and 10")
+        return v
+
+
+worker_config = WorkerSettings()
+
+
+class MemorySettings(pydantic.BaseSettings):
+    """Memory settings"""
+
+    # Spool the compressed tile to a temporary file, instead of a memory buffer
+    stream_output: bool = False
+    # Container memory limit in bytes (auto-detected when not set)
+    limit: Optional[int]
+    # Shed concurrency above `high` and restore it below `low` (fractions of limit)
+    high_watermark: float = 0.8
+    low_watermark: float = 0.6
+
+    class Config:
+        """model config"""
+
+        env_prefix = "MEMORY_"
+
+
+memory_config = MemorySettings()